@@ -1,5 +1,10 @@
-from .tokenize import new_token_base
+from . import cache
+from .tokenize import (new_token_base, map_chunks, LineIndex,
+                       TokenBaseMixin)
 from .dfa import NFAState, nfa2dfa
+from .symbol import SymbolTable
+from .state import State
+from .tree import CompactTree
 
 
 ASTTokenBase = new_token_base()
@@ -58,7 +63,7 @@ class Comment(ASTTokenBase):
     ignore = True
 
 
-ast_tokenizer = ASTTokenBase.get_tokenizer()
+ast_tokenizer = ASTTokenBase.get_tokenizer(cache.CACHE_DIR)
 
 
 class TokenLabel(object):
@@ -79,21 +84,830 @@ class TokenLabel(object):
         return isinstance(obj, self.__class__)
 
 
+# parse events, see ParseTables.events
+ENTER = 'enter'
+TOKEN = 'token'
+EXIT = 'exit'
+
+
 class GrammarError(Exception):
     pass
 
 
+class ParseError(Exception):
+
+    def __init__(self, message, offset=None):
+        Exception.__init__(self, message, offset)
+        self.message = message
+        self.offset = offset
+
+    def __str__(self):
+        return self.message
+
+
 class GrammarRule(object):
-    pass
+    # a parse tree node: the tokens and rule nodes it matched, `size` is
+    # how many tokens that is once parsed and `after` the state of the
+    # parent's rule DFA once the node is taken (see ParseTables.reparse)
+    size = None
+    after = None
+
+    def __init__(self, children=None):
+        self.children = [] if children is None else children
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__,
+                           ', '.join(repr(child) for child in self.children))
+
+    def __eq__(self, other):
+        return (other.__class__ is self.__class__ and
+                other.children == self.children)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class RuleStates(object):
+    # the rule DFAs with their states numbered rule by rule. `arcs[state]`
+    # lists (label, next state, rule index) in the DFA's arc order, label
+    # is a label id (see label_ids: a token class or a literal string)
+    # for token arcs, which have rule index -1. `symbols` numbers the
+    # token classes, those of `tokens` first, and the rules
+
+    def __init__(self, rules, tokens=()):
+        self.rules = list(rules.values())
+        self.rule_ids = rule_ids = dict((rule, k)
+                                        for k, rule in enumerate(self.rules))
+        states = []
+        index = {}
+        self.starts = []
+        self.owner = []
+        for k, rule in enumerate(self.rules):
+            self.starts.append(len(states))
+            index[rule.root] = len(states)
+            states.append(rule.root)
+            i = self.starts[-1]
+            while i < len(states):
+                self.owner.append(k)
+                for dst in states[i].arcs.values():
+                    if dst not in index:
+                        index[dst] = len(states)
+                        states.append(dst)
+                i += 1
+        self.final = [state.is_final for state in states]
+        self.label_ids = {}
+        arcs = []
+        for state in states:
+            state_arcs = []
+            for label, dst in state.arcs.items():
+                rule = rule_ids.get(label, -1)
+                if rule < 0:
+                    label = self.label_ids.setdefault(label,
+                                                      len(self.label_ids))
+                state_arcs.append((label, index[dst], rule))
+            arcs.append(state_arcs)
+        self.literal_ids = dict((label, label_id) for label, label_id
+                                in self.label_ids.items()
+                                if isinstance(label, str))
+        self.names = dict((label_id, label) for label, label_id
+                          in self.label_ids.items())
+        self.arcs = arcs
+        tokens = list(tokens)
+        tokens += [label for label in self.label_ids
+                   if not isinstance(label, str) and label not in tokens]
+        self.symbols = SymbolTable(tokens, self.rules)
+
+    def graph(self):
+        # the numbered states as State objects, arcs labeled by Symbol
+        symbols = self.symbols
+        ntokens = symbols.ntokens
+        states = [State(num, symbols[ntokens + self.owner[num]], final)
+                  for num, final in enumerate(self.final)]
+        for state, state_arcs in zip(states, self.arcs):
+            for label, dst, rule in state_arcs:
+                if rule >= 0:
+                    state.arc(symbols[ntokens + rule], states[dst])
+                elif isinstance(self.names[label], str):
+                    state.arc(None, states[dst], self.names[label])
+                else:
+                    state.arc(symbols[symbols.number(self.names[label])],
+                              states[dst])
+        return states
+
+    def rule_name(self, state):
+        return self.rules[self.owner[state]].__name__
+
+    def label_name(self, label_id):
+        label = self.names[label_id]
+        if isinstance(label, str):
+            return repr(label)
+        return label.__name__
+
+    def where(self, token):
+        position = token.position
+        if position is None:
+            return ''
+        return ' at line %d:%d' % position
+
+
+class ParseTables(RuleStates):
+    # LL(1) tables over the rule DFAs. `dispatch[state]` maps a label id
+    # to the arc it predicts, as (next state, rule index). `default[state]`
+    # is the one arc that may match nothing, taken when no arc predicts
+    # the token and the state isn't final
+
+    def __init__(self, rules, tokens=()):
+        RuleStates.__init__(self, rules, tokens)
+        arcs = self.arcs
+        self.nullable = [False] * len(self.rules)
+        changed = True
+        while changed:
+            changed = False
+            for k in range(len(self.rules)):
+                if not self.nullable[k] and self.skips(self.starts[k], arcs):
+                    self.nullable[k] = changed = True
+        self.check_left_recursion(arcs)
+
+        # label ids each state can start with, to a fixpoint
+        firsts = [set() for _ in arcs]
+        changed = True
+        while changed:
+            changed = False
+            for state, state_arcs in enumerate(arcs):
+                first = firsts[state]
+                size = len(first)
+                for label, dst, rule in state_arcs:
+                    first.update(self.predict(label, dst, rule, firsts))
+                changed = changed or len(first) != size
+
+        self.dispatch = []
+        self.default = []
+        for state, state_arcs in enumerate(arcs):
+            dispatch = {}
+            default = None
+            for label, dst, rule in state_arcs:
+                for label_id in self.predict(label, dst, rule, firsts):
+                    if dispatch.get(label_id, (dst, rule)) != (dst, rule):
+                        raise GrammarError(
+                            'rule %s is ambiguous: more than one arc takes '
+                            '%s' % (self.rule_name(state),
+                                    self.label_name(label_id)))
+                    dispatch[label_id] = (dst, rule)
+                if rule >= 0 and self.nullable[rule]:
+                    if default is not None:
+                        raise GrammarError(
+                            'rule %s is ambiguous: more than one arc may '
+                            'match nothing' % self.rule_name(state))
+                    default = (dst, rule)
+            self.dispatch.append(dispatch)
+            self.default.append(default)
+
+    def skips(self, start, arcs):
+        # if a final state is reachable from `start` matching nothing
+        seen = set([start])
+        pending = [start]
+        while pending:
+            state = pending.pop()
+            if self.final[state]:
+                return True
+            for label, dst, rule in arcs[state]:
+                if rule >= 0 and self.nullable[rule] and dst not in seen:
+                    seen.add(dst)
+                    pending.append(dst)
+        return False
+
+    def check_left_recursion(self, arcs):
+        # rules each rule may start with, a cycle would never consume
+        calls = []
+        for k in range(len(self.rules)):
+            called = set()
+            seen = set([self.starts[k]])
+            pending = [self.starts[k]]
+            while pending:
+                state = pending.pop()
+                for label, dst, rule in arcs[state]:
+                    if rule >= 0:
+                        called.add(rule)
+                        if self.nullable[rule] and dst not in seen:
+                            seen.add(dst)
+                            pending.append(dst)
+            calls.append(called)
+        for k in range(len(self.rules)):
+            seen = set()
+            pending = list(calls[k])
+            while pending:
+                rule = pending.pop()
+                if rule == k:
+                    raise GrammarError('rule %s is left recursive' %
+                                       self.rules[k].__name__)
+                if rule not in seen:
+                    seen.add(rule)
+                    pending.extend(calls[rule])
+
+    def predict(self, label, dst, rule, firsts):
+        if rule < 0:
+            return set([label])
+        if self.nullable[rule]:
+            return firsts[self.starts[rule]] | firsts[dst]
+        return firsts[self.starts[rule]]
+
+    def parse(self, tokens):
+        # the parse tree of the token iterable, an instance of the first
+        # rule. an explicit stack of [state, node, first token], one entry
+        # per rule being matched
+        dispatch = self.dispatch
+        literal_ids = self.literal_ids
+        label_ids = self.label_ids
+        tokens = iter(tokens)
+        token = next(tokens, None)
+        count = 0
+        tree = self.rules[0]()
+        stack = [[self.starts[0], tree, 0]]
+        while stack:
+            top = stack[-1]
+            state = top[0]
+            arc = None
+            if token is not None:
+                label_id = literal_ids.get(token.data, None)
+                if label_id is not None:
+                    arc = dispatch[state].get(label_id, None)
+                if arc is None:
+                    label_id = label_ids.get(token.__token_cls__, None)
+                    arc = dispatch[state].get(label_id, None)
+            if arc is None:
+                if self.final[state]:
+                    top[1].size = count - top[2]
+                    stack.pop()
+                    continue
+                arc = self.default[state]
+                if arc is None:
+                    raise self.error(state, token)
+            top[0], rule = arc
+            if rule < 0:
+                top[1].children.append(token)
+                token = next(tokens, None)
+                count += 1
+                continue
+            node = self.rules[rule]()
+            node.after = top[0]
+            top[1].children.append(node)
+            stack.append([self.starts[rule], node, count])
+        if token is not None:
+            raise ParseError('unexpected %r after the end%s' % (
+                token, self.where(token)), token.start)
+        return tree
+
+    def reparse(self, batch, reuse):
+        # parse() of a TokenBatch after an edit, `reuse` (a NodeReuse)
+        # holding the old parse. the parse starts where the old one was
+        # when it got to the first token scanned again, the nodes it was
+        # in are copied with their children so far. past the edit the old
+        # nodes reuse finds are taken whole, and as soon as one of the
+        # copies is back on top of the stack in the state the old parse
+        # had at the same token, the rest is the old parse: every copy on
+        # the stack takes the old node's remaining children. the
+        # lookahead is read off the batch as parse_compact does, tokens
+        # are only made for the children they become
+        dispatch = self.dispatch
+        literal_ids = self.literal_ids
+        kind_ids = [self.label_ids.get(token, None) for token in batch.tokens]
+        # kinds whose data isn't their text, the token is made to see it
+        made = [token.__init__ is not TokenBaseMixin.__init__
+                for token in batch.tokens]
+        kinds = batch.kinds
+        count = len(kinds)
+        # [state, node, first token, old node, its next child and the
+        # old position of that] per rule being matched, the old node is
+        # None for new nodes
+        stack = []
+        for old, k, start, pos in reuse.chain:
+            node = old.__class__(old.children[:k + 1])
+            node.after = old.after
+            if stack:
+                stack[-1][1].children[-1] = node
+            stack.append([self.replay(old, k + 1), node, start, old, k + 1,
+                          pos])
+        tree = stack[0][1]
+        i = reuse.first
+        while stack:
+            top = stack[-1]
+            if (top[3] is not None and reuse.new_stop <= i < count and
+                    self.resync(top, i - reuse.moved)):
+                for _, node, _, old, k, _ in stack:
+                    node.children.extend(old.children[k:])
+                    node.size = old.size + reuse.moved
+                i = count
+                break
+            state = top[0]
+            arc = None
+            if i < count:
+                if literal_ids:
+                    if made[kinds[i]]:
+                        data = batch[i].data
+                    else:
+                        data = batch.text(i)
+                    label_id = literal_ids.get(data, None)
+                    if label_id is not None:
+                        arc = dispatch[state].get(label_id, None)
+                if arc is None:
+                    arc = dispatch[state].get(kind_ids[kinds[i]], None)
+            if arc is None:
+                if self.final[state]:
+                    top[1].size = i - top[2]
+                    stack.pop()
+                    continue
+                arc = self.default[state]
+                if arc is None:
+                    raise self.error(state, batch[i] if i < count else None)
+            top[0], rule = arc
+            if rule < 0:
+                top[1].children.append(batch[i])
+                i += 1
+                continue
+            node = reuse.find(self.rules[rule], i)
+            if node is not None:
+                node.after = top[0]
+                top[1].children.append(node)
+                i += node.size
+            else:
+                node = self.rules[rule]()
+                node.after = top[0]
+                top[1].children.append(node)
+                stack.append([self.starts[rule], node, i, None, 0, 0])
+        if i < count:
+            token = batch[i]
+            raise ParseError('unexpected %r after the end%s' % (
+                token, self.where(token)), token.start)
+        return tree
+
+    def resync(self, frame, pos):
+        # if the old parse was at old token `pos` in the state of a
+        # reparse() stack entry, with the entry's old node on top: one of
+        # its children starts there. the entry's next child is moved up
+        # to it
+        old = frame[3]
+        children = old.children
+        k = frame[4]
+        at = frame[5]
+        while k < len(children) and at < pos:
+            child = children[k]
+            at += child.size if isinstance(child, GrammarRule) else 1
+            k += 1
+        frame[4] = k
+        frame[5] = at
+        if at != pos:
+            return False
+        # before each of the empty nodes there too, or at the node's end
+        while True:
+            if frame[0] == self.replay(old, k):
+                frame[4] = k
+                return True
+            if (k == len(children) or
+                    not isinstance(children[k], GrammarRule) or
+                    children[k].size):
+                return False
+            k += 1
+
+    def replay(self, node, stop):
+        # the state of the node's rule DFA once its first `stop` children
+        # are matched: the `after` of the last rule node among them, then
+        # the arcs the tokens after it predict
+        children = node.children
+        k = stop
+        while k and (not isinstance(children[k - 1], GrammarRule) or
+                     children[k - 1].after is None):
+            k -= 1
+        if k:
+            state = children[k - 1].after
+        else:
+            state = self.starts[self.rule_ids[node.__class__]]
+        for child in children[k:stop]:
+            token = child
+            if isinstance(child, GrammarRule):
+                token = first_token(child)
+            arc = None
+            if token is not None:
+                label_id = self.literal_ids.get(token.data, None)
+                if label_id is not None:
+                    arc = self.dispatch[state].get(label_id, None)
+                if arc is None:
+                    label_id = self.label_ids.get(token.__token_cls__, None)
+                    arc = self.dispatch[state].get(label_id, None)
+            if arc is None:
+                arc = self.default[state]
+            state = arc[0]
+        return state
+
+    def events(self, tokens):
+        # the parse as (ENTER, rule class), (TOKEN, token) and (EXIT, rule
+        # class) events, taking the tokens as they come: nothing is kept
+        # but the stack, one DFA state per rule being matched
+        dispatch = self.dispatch
+        literal_ids = self.literal_ids
+        label_ids = self.label_ids
+        rules = self.rules
+        tokens = iter(tokens)
+        token = next(tokens, None)
+        stack = [self.starts[0]]
+        yield ENTER, rules[0]
+        while stack:
+            state = stack[-1]
+            arc = None
+            if token is not None:
+                label_id = literal_ids.get(token.data, None)
+                if label_id is not None:
+                    arc = dispatch[state].get(label_id, None)
+                if arc is None:
+                    label_id = label_ids.get(token.__token_cls__, None)
+                    arc = dispatch[state].get(label_id, None)
+            if arc is None:
+                if self.final[state]:
+                    stack.pop()
+                    yield EXIT, rules[self.owner[state]]
+                    continue
+                arc = self.default[state]
+                if arc is None:
+                    raise self.error(state, token)
+            stack[-1], rule = arc
+            if rule < 0:
+                yield TOKEN, token
+                token = next(tokens, None)
+            else:
+                stack.append(self.starts[rule])
+                yield ENTER, rules[rule]
+        if token is not None:
+            raise ParseError('unexpected %r after the end%s' % (
+                token, self.where(token)), token.start)
+
+    def parse_compact(self, batch):
+        # the parse of a TokenBatch as a CompactTree, as parse does it but
+        # without an object per token or node. an explicit stack of
+        # [state, node, first token, last child]
+        dispatch = self.dispatch
+        literal_ids = self.literal_ids
+        symbols = self.symbols
+        kind_ids = [self.label_ids.get(token, None) for token in batch.tokens]
+        kind_symbols = [symbols.number(token) for token in batch.tokens]
+        ntokens = symbols.ntokens
+        kinds = batch.kinds
+        starts = batch.starts
+        ends = batch.ends
+        count = len(kinds)
+        tree = CompactTree(symbols, batch.data, batch.encoding)
+        add = tree.add
+        i = 0
+        root = add(ntokens, starts[0] if count else len(batch.data), 0)
+        stack = [[self.starts[0], root, 0, -1]]
+        while stack:
+            top = stack[-1]
+            state = top[0]
+            arc = None
+            if i < count:
+                if literal_ids:
+                    label_id = literal_ids.get(batch.text(i), None)
+                    if label_id is not None:
+                        arc = dispatch[state].get(label_id, None)
+                if arc is None:
+                    arc = dispatch[state].get(kind_ids[kinds[i]], None)
+            if arc is None:
+                if self.final[state]:
+                    node = top[1]
+                    if i > top[2]:
+                        tree.ends[node] = ends[i - 1]
+                    else:
+                        tree.ends[node] = tree.starts[node]
+                    stack.pop()
+                    continue
+                arc = self.default[state]
+                if arc is None:
+                    raise self.error(state, batch[i] if i < count else None)
+            top[0], rule = arc
+            if rule < 0:
+                top[3] = add(kind_symbols[kinds[i]], starts[i], ends[i],
+                             top[1], top[3])
+                i += 1
+            else:
+                start = starts[i] if i < count else len(batch.data)
+                top[3] = node = add(ntokens + rule, start, start, top[1],
+                                    top[3])
+                stack.append([self.starts[rule], node, i, -1])
+        if i < count:
+            token = batch[i]
+            raise ParseError('unexpected %r after the end%s' % (
+                token, self.where(token)), token.start)
+        return tree
+
+    def error(self, state, token):
+        expected = ', '.join(sorted(self.label_name(label_id)
+                                    for label_id in self.dispatch[state]))
+        if token is None:
+            return ParseError('unexpected end in %s, expected %s' % (
+                self.rule_name(state), expected))
+        return ParseError('unexpected %r%s in %s, expected %s' % (
+            token, self.where(token), self.rule_name(state), expected),
+            token.start)
+
+
+class MemoTable(object):
+    # packrat results by token position: a list with the result of each
+    # rule there (None if unknown, False if it doesn't match, else
+    # (end, node)) and the set of DFA states known to fail there. with a
+    # `window`, positions more than that many tokens behind the furthest
+    # one reached are dropped, a rule needed there again is matched again
+
+    def __init__(self, nrules, window=None):
+        self.nrules = nrules
+        self.window = window
+        self.results = {}
+        self.dead = {}
+        self.low = 0
+
+    def __len__(self):
+        return len(self.results)
+
+    def get(self, rule, pos):
+        results = self.results.get(pos, None)
+        if results is None:
+            return None
+        return results[rule]
+
+    def put(self, rule, pos, value):
+        if pos < self.low:
+            return
+        results = self.results.get(pos, None)
+        if results is None:
+            results = self.results[pos] = [None] * self.nrules
+        results[rule] = value
+
+    def is_dead(self, state, pos):
+        dead = self.dead.get(pos, None)
+        return dead is not None and state in dead
+
+    def kill(self, state, pos):
+        if pos >= self.low:
+            self.dead.setdefault(pos, set()).add(state)
+
+    def reach(self, pos):
+        if self.window is None:
+            return
+        low = pos - self.window
+        while self.low < low:
+            self.results.pop(self.low, None)
+            self.dead.pop(self.low, None)
+            self.low += 1
+
+
+class PackratParser(RuleStates):
+    # PEG-style parsing for grammars that aren't LL(1): the arcs of a
+    # state are tried in order, backtracking when a path fails, and a
+    # rule gets the first way through its DFA that works (with the
+    # state's arcs tried before stopping at a final state). rule results
+    # are memoized per position, see MemoTable
+
+    def __init__(self, rules, window=None):
+        RuleStates.__init__(self, rules)
+        self.window = window
+
+    def parse(self, tokens, memo=None):
+        # an explicit stack of [rule, start, choices, children], one entry
+        # per rule being matched. `choices` holds [state, position, next
+        # arc] per arc taken, children the node each of them matched
+        tokens = list(tokens)
+        if memo is None:
+            memo = MemoTable(len(self.rules), self.window)
+        literal_ids = self.literal_ids
+        label_ids = self.label_ids
+        ids = [(literal_ids.get(token.data, -1),
+                label_ids.get(token.__token_cls__, -1)) for token in tokens]
+        arcs = self.arcs
+        final = self.final
+        # the furthest a token arc failed, and what it expected there
+        fail_pos = 0
+        expected = set()
+        active = set([(0, 0)])
+        frames = [[0, 0, [[self.starts[0], 0, 0]], []]]
+        returned = None
+        while True:
+            rule, start, choices, children = frames[-1]
+            choice = choices[-1]
+            state, pos, k = choice
+            if returned is not None:
+                value, returned = returned, None
+            elif k < len(arcs[state]):
+                label, dst, sub = arcs[state][k]
+                if sub < 0:
+                    if pos < len(tokens) and label in ids[pos]:
+                        value = (pos + 1, tokens[pos])
+                    else:
+                        value = False
+                        if pos > fail_pos:
+                            fail_pos = pos
+                            expected = set()
+                        if pos == fail_pos:
+                            expected.add(label)
+                else:
+                    value = memo.get(sub, pos)
+                    if value is None:
+                        if (sub, pos) in active:
+                            # left recursion never gets anywhere
+                            value = False
+                        else:
+                            active.add((sub, pos))
+                            frames.append([sub, pos,
+                                           [[self.starts[sub], pos, 0]], []])
+                            continue
+            else:
+                if final[state]:
+                    node = self.rules[rule](list(children))
+                    node.size = pos - start
+                    value = (pos, node)
+                else:
+                    memo.kill(state, pos)
+                    choices.pop()
+                    if choices:
+                        children.pop()
+                        continue
+                    value = False
+                frames.pop()
+                active.discard((rule, start))
+                memo.put(rule, start, value)
+                if not frames:
+                    break
+                returned = value
+                continue
+
+            label, dst, sub = arcs[state][k]
+            choice[2] = k + 1
+            if value is not False:
+                end, node = value
+                if not memo.is_dead(dst, end):
+                    memo.reach(end)
+                    children.append(node)
+                    choices.append([dst, end, 0])
+
+        if value is not False:
+            end, tree = value
+            if end == len(tokens):
+                return tree
+            if end > fail_pos:
+                token = tokens[end]
+                raise ParseError('unexpected %r after the end%s' % (
+                    token, self.where(token)), token.start)
+        if fail_pos < len(tokens):
+            token = tokens[fail_pos]
+            raise ParseError('unexpected %r%s, expected %s' % (
+                token, self.where(token), self.expected(expected)),
+                token.start)
+        raise ParseError('unexpected end, expected %s' %
+                         self.expected(expected))
+
+    def expected(self, label_ids):
+        return ', '.join(sorted(self.label_name(label_id)
+                                for label_id in label_ids))
+
+
+def first_token(node):
+    # the first token under a rule node, None if it matched nothing
+    stack = [[node.children, 0]]
+    while stack:
+        top = stack[-1]
+        children, k = top
+        if k == len(children):
+            stack.pop()
+            continue
+        top[1] = k + 1
+        child = children[k]
+        if not isinstance(child, GrammarRule):
+            return child
+        stack.append([child.children, 0])
+    return None
+
+
+def child_start(child):
+    # the offset a child of a node starts at, None for an empty rule node
+    if isinstance(child, GrammarRule):
+        child = first_token(child)
+        if child is None:
+            return None
+    return child.start
+
+
+def child_at(children, offset):
+    # the index of the last of the children starting at or before offset,
+    # a binary search skipping the empty rule nodes
+    lo = 0
+    hi = len(children)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        k = mid
+        start = None
+        while k < hi:
+            start = child_start(children[k])
+            if start is not None:
+                break
+            k += 1
+        if start is None or start > offset:
+            hi = mid
+        else:
+            lo = k + 1
+    return lo - 1
+
+
+class NodeReuse(object):
+    # an old parse tree for ParseTables.reparse once an edit turned its
+    # tokens [first, old_stop) into [first, new_stop) of `batch`. `chain`
+    # lists [node, child index, first token, end of the child] from the
+    # root down to the node holding token first - 1 as that child: the
+    # rules the old parse was matching when it got to token first. an
+    # LL(1) rule matches the same at the same tokens, past the edit find()
+    # gives the old node of a rule at a position
+
+    def __init__(self, tree, batch, first, old_stop, new_stop):
+        self.first = first
+        self.new_stop = new_stop
+        self.moved = new_stop - old_stop
+        self.chain = [[tree, -1, 0, 0]]
+        # [children, next child, its token position] per node walked into
+        self.stack = [[[tree], 0, 0]]
+        if not first:
+            return
+        self.stack[0][1:] = [1, tree.size]
+        offset = batch.span(first - 1)[0]
+        while True:
+            top = self.chain[-1]
+            children = top[0].children
+            k = top[1] = child_at(children, offset)
+            child = children[k]
+            if not isinstance(child, GrammarRule):
+                top[3] = first
+                self.stack.append([children, k + 1, first])
+                break
+            start = batch.find_start(first_token(child).start)
+            top[3] = start + child.size
+            self.stack.append([children, k + 1, top[3]])
+            self.chain.append([child, -1, start, start])
+
+    def find(self, rule, pos):
+        # positions only go forward, so does the walk of the old tree
+        if pos < self.new_stop:
+            return None
+        return self.seek(rule, pos - self.moved)
+
+    def seek(self, rule, pos):
+        # the old node of class `rule` matching tokens from `pos` on
+        stack = self.stack
+        while stack:
+            top = stack[-1]
+            children, k, start = top
+            if k == len(children):
+                stack.pop()
+                continue
+            child = children[k]
+            if not isinstance(child, GrammarRule):
+                if start >= pos:
+                    return None
+                top[1] = k + 1
+                top[2] = start + 1
+                continue
+            if child.size is None:
+                return None
+            end = start + child.size
+            if end <= pos:
+                top[1] = k + 1
+                top[2] = end
+                continue
+            if start > pos:
+                return None
+            if start == pos and child.__class__ is rule:
+                return child
+            top[1] = k + 1
+            top[2] = end
+            stack.append([child.children, 0, start])
+        return None
 
 
 class ASTBuilder(object):
 
-    def __init__(self, token_base, grammar):
+    def __init__(self, token_base, grammar, cache_dir=None, packrat=False,
+                 memo_window=None):
+        # packrat: parse with PackratParser, for grammars that aren't
+        # LL(1), keeping `memo_window` token positions of memo
         self.token_base = token_base
-        self.tokenizer = token_base.get_tokenizer()
+        self.tokenizer = token_base.get_tokenizer(cache_dir)
         self.grammar = grammar
-        self._build_rules()
+        self.cache_dir = cache_dir
+        self.packrat = packrat
+        self.memo_window = memo_window
+        self.rules = None
+        self.tables = None
+        if cache_dir is not None:
+            self.rules = cache.load_rules(
+                token_base, grammar, cache_dir, GrammarRule)
+        if self.rules is None:
+            self._build_rules()
+            if cache_dir is not None:
+                cache.save_rules(
+                    token_base, grammar, self.rules, cache_dir, GrammarRule)
 
     def _preprocess_rules(self):
         tks = ast_tokenizer.tokens(self.grammar)
@@ -133,20 +947,26 @@ class ASTBuilder(object):
         pre_rules = self._preprocess_rules()
         for rule_name, (rulecls, tks) in pre_rules.items():
             par_stack = []
-            cur = root = NFAState()
+            arena = []
+            cur = root = NFAState(arena)
             for tk in tks:
                 if cur is None:
                     raise GrammarError('invalid token: %r' % tk)
                 if isinstance(tk, LeftOp):
+                    # a state of its own, so `?`, `+` and `*` don't loop
+                    # through what comes before the group
+                    cur = cur.arc(None, NFAState(arena))
                     par_stack.append([cur, None])
                 elif isinstance(tk, RightOp):
                     if len(par_stack) == 0:
                         raise GrammarError('invalid `)`, missing `(`')
                     start, end = par_stack.pop()
+                    if start is cur:
+                        raise GrammarError('empty `()`')
                     if end is None:
                         end = cur
-                    if start is end:
-                        raise GrammarError('empty `()`')
+                    else:
+                        cur.arc(None, end)
                     if len(tk.data) == 2:
                         op = tk.data[1]
                         if op == '?':
@@ -156,31 +976,199 @@ class ASTBuilder(object):
                         elif op == '*':
                             start.arc(None, end)
                             end.arc(None, start)
-                        if cur is not end:
-                            cur = cur.arc(None, end)
+                    cur = end.arc(None, NFAState(arena))
                 elif isinstance(tk, Or):
                     if len(par_stack) == 0:
                         raise GrammarError('invalid `|`, missing `(`')
                     start, end = par_stack[-1]
-                    if end is None:
-                        par_stack[-1][1] = cur
                     if start is cur:
                         raise GrammarError('invalid `(|`')
+                    if end is None:
+                        end = par_stack[-1][1] = NFAState(arena)
+                    cur.arc(None, end)
                     cur = start
                 elif isinstance(tk, Name):
                     label = self.tokenizer.get_token_cls(tk.data)
                     if label is None:
-                        label, _ = pre_rules.get(tk.data, None)
-                        if label is None:
+                        rule = pre_rules.get(tk.data, None)
+                        if rule is None:
                             raise GrammarError('unknown %s' % tk.data)
-                    cur = cur.arc(label, NFAState())
+                        label = rule[0]
+                    cur = cur.arc(label, NFAState(arena))
                 elif isinstance(tk, String):
-                    cur = cur.arc(tk.data, NFAState())
+                    cur = cur.arc(tk.data, NFAState(arena))
             cur.is_final = True
             cur.data = rulecls
             rulecls.root = nfa2dfa(root)
             rules[rule_name] = rulecls
         self.rules = rules
 
+    def get_tables(self):
+        # built on first use: a grammar that isn't LL(1) still loads
+        if self.tables is None:
+            if self.packrat:
+                self.tables = PackratParser(self.rules, self.memo_window)
+            else:
+                self.tables = ParseTables(self.rules,
+                                          self.tokenizer.dfa.tokens)
+        return self.tables
+
     def build(self, src):
-        pass
+        return self.parse_tokens(self.tokenizer.tokens(src))
+
+    def parse_tokens(self, tokens):
+        return self.get_tables().parse(tokens)
+
+    def events(self, source, chunk_size=65536, encoding='utf-8'):
+        # ParseTables.events of a str, or of a file, bytes or chunks read
+        # as Tokenizer.stream does, for the LL(1) tables: memory is
+        # bounded by the nesting depth and the chunk size
+        if self.packrat:
+            raise Exception('parse events need the LL(1) tables')
+        if isinstance(source, str):
+            tokens = self.tokenizer.tokens(source)
+        else:
+            tokens = self.tokenizer.stream(source, chunk_size, encoding)
+        return self.get_tables().events(tokens)
+
+    def walk(self, source, callbacks, chunk_size=65536, encoding='utf-8'):
+        # events() dispatched to callbacks[rule class or name](event,
+        # value): ENTER and EXIT of the rule, and TOKEN for the tokens it
+        # matches itself
+        found = [None]
+        for event, value in self.events(source, chunk_size, encoding):
+            if event == TOKEN:
+                callback = found[-1]
+                if callback is not None:
+                    callback(event, value)
+                continue
+            if event == ENTER:
+                callback = callbacks.get(value, None)
+                if callback is None:
+                    callback = callbacks.get(value.__name__, None)
+                found.append(callback)
+            else:
+                callback = found.pop()
+            if callback is not None:
+                callback(event, value)
+
+    def build_compact(self, src):
+        # build() as a CompactTree, for the LL(1) tables
+        if self.packrat:
+            raise Exception('compact trees need the LL(1) tables')
+        return self.get_tables().parse_compact(self.tokenizer.batch(src))
+
+    def build_batch(self, src):
+        # (tree, TokenBatch) of src, what edit() takes
+        batch = self.tokenizer.batch(src)
+        return self.parse_tokens(batch), batch
+
+    def edit(self, tree, batch, offset, deleted, inserted):
+        # (tree, batch) once the `deleted` chars at `offset` of batch.data
+        # are replaced by `inserted`, `tree` being the parse of `batch`.
+        # only the tokens around the edit are scanned again (see
+        # Tokenizer.edit) and the nodes of `tree` the edit can't change
+        # are taken into the new tree, `tree` is spent
+        batch, (first, old_stop, new_stop) = self.tokenizer.edit(
+            batch, offset, deleted, inserted)
+        if self.packrat:
+            # a PEG rule may look any distance ahead, nothing is reused
+            return self.parse_tokens(batch), batch
+        reuse = NodeReuse(tree, batch, first, old_stop, new_stop)
+        return self.get_tables().reparse(batch, reuse), batch
+
+    def parse_many(self, docs, workers=None, chunk_size=64, ordered=True):
+        # build() of many documents in `workers` processes, as
+        # Tokenizer.tokenize_many does. the workers build their own
+        # ASTBuilder, the token base has to be importable by them
+        initargs = (self.token_base, self.grammar, self.cache_dir,
+                    self.packrat, self.memo_window)
+        for i, doc, result in map_chunks(
+                init_builder, initargs, build_docs, docs, workers,
+                chunk_size, ordered):
+            if isinstance(result, Exception):
+                yield i, result
+                continue
+            tree, error = result
+            if error is None:
+                yield i, self.unpack_tree(tree, doc)
+            elif error == ():
+                yield i, self.token_base.UnexpectedEOFError()
+            elif isinstance(error, tuple):
+                yield i, self.token_base.UnexpectedCharError(
+                    LineIndex(doc), *error)
+            else:
+                yield i, error
+
+    def unpack_tree(self, packed, doc):
+        # the tree pack_tree made of a parse of `doc`, with this builder's
+        # rule classes
+        tokens = self.tokenizer.dfa.tokens
+        lines = LineIndex(doc)
+        tree = None
+        # [node, children still to come]
+        pending = []
+        for first, second, third in packed:
+            if isinstance(first, str):
+                node = self.rules[first]()
+                node.size = second
+            else:
+                node = tokens[first](doc[second:third])
+                node.place(second, third, lines)
+            if pending:
+                top = pending[-1]
+                top[0].children.append(node)
+                top[1] -= 1
+                if not top[1]:
+                    pending.pop()
+            else:
+                tree = node
+            if isinstance(first, str) and third:
+                pending.append([node, third])
+        return tree
+
+
+def pack_tree(tree, kinds):
+    # a parse tree as a flat preorder list of (rule name, size, number
+    # of children) and (kind, start, end) for tokens: the rule classes
+    # are made at runtime and don't pickle, nor do very deep tuples
+    packed = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, GrammarRule):
+            packed.append((node.__class__.__name__, node.size,
+                           len(node.children)))
+            stack.extend(reversed(node.children))
+        else:
+            packed.append((kinds[node.__class__], node.start, node.end))
+    return packed
+
+
+worker_builder = None
+
+
+def init_builder(token_base, grammar, cache_dir, packrat, memo_window):
+    global worker_builder
+    worker_builder = ASTBuilder(token_base, grammar, cache_dir, packrat,
+                                memo_window)
+
+
+def build_docs(docs):
+    # (tree, None) or (None, error) per document. errors of the token
+    # base don't pickle, they are sent as (offset, char) and () instead
+    token_base = worker_builder.token_base
+    kinds = dict((token, kind) for kind, token
+                 in enumerate(worker_builder.tokenizer.dfa.tokens))
+    results = []
+    for doc in docs:
+        try:
+            results.append((pack_tree(worker_builder.build(doc), kinds),
+                            None))
+        except token_base.UnexpectedCharError as e:
+            results.append((None, (e.offset, e.char)))
+        except token_base.UnexpectedEOFError:
+            results.append((None, ()))
+        except Exception as e:
+            results.append((None, e))
+    return results
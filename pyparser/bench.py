@@ -0,0 +1,259 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+from .tokenize import new_token_base
+from .dfa import nfa2dfa, compile_dfa, CharClasses
+from .ast import ASTBuilder
+
+
+# python -m pyparser.bench run -o new.json
+# python -m pyparser.bench compare old.json new.json
+
+GRAMMAR = '''
+Stmts = (Stmt ';')* ;
+Stmt = ('let' Name '=' Expr | 'print' '(' Args ')' | Expr) ;
+Args = Expr (',' Expr)* ;
+Expr = Term (('+' | '-' | '*' | '/') Term)* ;
+Term = (Num | String | Name ('(' Args ')')? | '(' Expr ')') ;
+'''
+
+
+def token_base(count=0, ranges=1):
+    # a small language's tokens, with `count` extra tokens and a Name
+    # char class of `ranges` intervals
+    TokenBase = new_token_base()
+    first = 'a-z_' + ''.join('%s-%s' % (chr(0x4e00 + 4 * i),
+                                         chr(0x4e01 + 4 * i))
+                              for i in range(ranges - 1))
+    tokens = [('Num', '[0-9]+([.][0-9]+)?'),
+              ('String', "'(\\\\['rnt\\\\]|[^'\\\\])*'"),
+              ('Name', '[%s][%s0-9]*' % (first, first)),
+              ('Op', '[+\\-*/=(),;]')]
+    for i in range(count):
+        tokens.append(('T%d' % i, '<%s>' % word(i)))
+    for name, expr in tokens:
+        type(name, (TokenBase,), {'regular_expr': expr})
+    type('Blank', (TokenBase,), {'regular_expr': '[ \t\n]+',
+                                 'ignore': True})
+    type('Comment', (TokenBase,), {'regular_expr': '#[^\n]*',
+                                   'ignore': True})
+    return TokenBase
+
+
+def word(i):
+    letters = ''
+    while True:
+        letters += chr(ord('a') + i % 26)
+        i //= 26
+        if not i:
+            return letters
+
+
+def program(size, seed=0):
+    # about `size` chars of statements GRAMMAR parses
+    rand = random.Random(seed)
+    names = ['x', 'count', 'total_2', 'name', 'value']
+    parts = []
+    length = 0
+    while length < size:
+        terms = []
+        for _ in range(rand.randint(1, 5)):
+            kind = rand.random()
+            if kind < 0.4:
+                terms.append(rand.choice(names))
+            elif kind < 0.7:
+                terms.append(str(rand.randint(0, 10 ** 6)))
+            elif kind < 0.8:
+                terms.append("'text %d\\n'" % rand.randint(0, 99))
+            else:
+                terms.append('f(%s, 1.5)' % rand.choice(names))
+        expr = (' %s ' % rand.choice('+-*/')).join(terms)
+        if rand.random() < 0.5:
+            line = 'let %s = %s;' % (rand.choice(names), expr)
+        else:
+            line = 'print(%s);' % expr
+        if rand.random() < 0.1:
+            line += ' # note'
+        parts.append(line)
+        length += len(line) + 1
+    return '\n'.join(parts) + '\n'
+
+
+def best(func, repeat):
+    # least seconds of `repeat` calls
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def build_benchmarks(repeat, counts, ranges):
+    results = {}
+    for count in counts:
+        name = 'build/patterns-%d' % count
+        results.update(build_phases(name, repeat, count, 1))
+    for size in ranges:
+        name = 'build/class-ranges-%d' % size
+        results.update(build_phases(name, repeat, 0, size))
+    return results
+
+
+def build_phases(name, repeat, count, ranges):
+    # the token base classes (TokenBuilder runs as they are made), the
+    # subset construction and minimizing, and the flat tables
+    results = {}
+    results[name + '/classes'] = {'seconds': best(
+        lambda: token_base(count, ranges), repeat)}
+    TokenBase = token_base(count, ranges)
+    nfa = TokenBase.generate_nfa()
+    classes = CharClasses([nfa])
+    results[name + '/nfa2dfa'] = {'seconds': best(
+        lambda: nfa2dfa(nfa, classes=classes), repeat)}
+    if count <= 50:
+        # simplify_dfa is quadratic in the DFA states
+        results[name + '/simplify_dfa'] = {'seconds': best(
+            lambda: nfa2dfa(nfa, legacy_simplify=True), repeat)}
+    dfa = TokenBase.generate_dfa()
+    tokens = list(TokenBase.__tokens__.values())
+    results[name + '/compile_dfa'] = {'seconds': best(
+        lambda: compile_dfa(dfa, dfa.classes, tokens), repeat)}
+    return results
+
+
+def scan_benchmarks(repeat, size):
+    TokenBase = token_base()
+    tokenizer = TokenBase.get_tokenizer()
+    src = program(size)
+    count = len(tokenizer.batch(src))
+    modes = [('tokens', lambda: sum(1 for _ in tokenizer.tokens(src))),
+             ('scan', lambda: sum(1 for _ in tokenizer.scan(src))),
+             ('batch', lambda: tokenizer.batch(src))]
+    try:
+        fast = TokenBase.get_tokenizer(backend='re')
+    except Exception:
+        pass
+    else:
+        modes.append(('re-scan', lambda: sum(1 for _ in fast.scan(src))))
+    data = src.encode('utf-8')
+    modes.append(('batch-bytes', lambda: tokenizer.batch(data)))
+    results = {}
+    for mode, func in modes:
+        seconds = best(func, repeat)
+        results['scan/' + mode] = {
+            'seconds': seconds,
+            'mb_per_s': len(src) / seconds / 1e6,
+            'tokens_per_s': count / seconds}
+    return results
+
+
+def parse_benchmarks(repeat, size):
+    TokenBase = token_base()
+    results = {}
+    results['grammar/compile'] = {'seconds': best(
+        lambda: ASTBuilder(TokenBase, GRAMMAR).get_tables(), repeat)}
+    ast = ASTBuilder(TokenBase, GRAMMAR)
+    src = program(size)
+    count = len(ast.tokenizer.batch(src))
+    modes = [('build', lambda: ast.build(src)),
+             ('build_compact', lambda: ast.build_compact(src)),
+             ('events', lambda: sum(1 for _ in ast.events(src)))]
+    for mode, func in modes:
+        seconds = best(func, repeat)
+        results['parse/' + mode] = {
+            'seconds': seconds,
+            'mb_per_s': len(src) / seconds / 1e6,
+            'tokens_per_s': count / seconds}
+    return results
+
+
+def run(repeat=3, size=2000000, counts=(10, 100, 400), ranges=(1, 100, 1000)):
+    # every benchmark as {'meta': {...}, 'results': {name: measures}},
+    # measures holding `seconds`, the least of `repeat` runs
+    results = {}
+    results.update(build_benchmarks(repeat, counts, ranges))
+    results.update(scan_benchmarks(repeat, size))
+    results.update(parse_benchmarks(repeat, size // 4))
+    return {
+        'meta': {'python': platform.python_version(),
+                 'implementation': platform.python_implementation(),
+                 'machine': platform.machine(),
+                 'repeat': repeat,
+                 'size': size,
+                 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+        'results': results}
+
+
+def compare(old, new, threshold=0.1, noise=0.001):
+    # (name, old seconds, new seconds, new / old, regressed) of the
+    # benchmarks both runs have, regressed if more than `threshold`
+    # slower and by more than `noise` seconds
+    rows = []
+    for name in sorted(set(old['results']) & set(new['results'])):
+        before = old['results'][name]['seconds']
+        after = new['results'][name]['seconds']
+        ratio = after / before if before else float('inf')
+        regressed = ratio > 1 + threshold and after - before > noise
+        rows.append((name, before, after, ratio, regressed))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pyparser.bench')
+    commands = parser.add_subparsers(dest='command')
+    run_parser = commands.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('-o', '--output', help='JSON file to write')
+    run_parser.add_argument('--repeat', type=int,
+                            help='runs of each benchmark (3, 1 if quick)')
+    run_parser.add_argument('--size', type=int,
+                            help='chars of input to tokenize (2000000, '
+                                 '100000 if quick)')
+    run_parser.add_argument('--quick', action='store_true',
+                            help='small inputs and token bases')
+    compare_parser = commands.add_parser(
+        'compare', help='compare two runs, fails on regressions')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='slowdown counted as a regression')
+    compare_parser.add_argument('--noise', type=float, default=0.001,
+                                help='seconds of difference to ignore')
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        # --quick only changes what --repeat and --size leave unset
+        if args.quick:
+            report = run(1 if args.repeat is None else args.repeat,
+                         100000 if args.size is None else args.size,
+                         (10, 50), (1, 50))
+        else:
+            report = run(3 if args.repeat is None else args.repeat,
+                         2000000 if args.size is None else args.size)
+        text = json.dumps(report, indent=2, sort_keys=True)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text + '\n')
+        else:
+            print(text)
+        return 0
+    if args.command == 'compare':
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        rows = compare(old, new, args.threshold, args.noise)
+        for name, before, after, ratio, regressed in rows:
+            print('%-40s %10.4f %10.4f %7.2fx%s' % (
+                name, before, after, ratio, '  REGRESSION' if regressed
+                else ''))
+        return 1 if any(row[-1] for row in rows) else 0
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
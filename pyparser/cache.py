@@ -0,0 +1,179 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from .dfa import DFAState, DFATable
+
+
+# file layout: header, 8-byte aligned arrays, then a JSON meta block
+# naming the key and where each array lives. arrays are stored in
+# native byte order so a loaded table is a read-only view of the mmap,
+# shared by every process that maps the same file
+MAGIC = b'PYPD'
+VERSION = 2
+HEADER = struct.Struct('<4sIQQ')
+
+CACHE_DIR = os.environ.get('PYPARSER_CACHE_DIR', None)
+
+
+def token_base_key(token_base):
+    digest = hashlib.sha1(('%d\0' % VERSION).encode('utf-8'))
+    for name, token in token_base.__tokens__.items():
+        digest.update(('%s\0%s\0%d\0' % (
+            name, token.regular_expr, token.ignore)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def grammar_key(token_base, grammar):
+    digest = hashlib.sha1(token_base_key(token_base).encode('utf-8'))
+    digest.update(grammar.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def cache_path(cache_dir, kind, key):
+    return os.path.join(cache_dir, '%s-%s.pdfa' % (kind, key))
+
+
+def write_cache(path, key, meta, arrays):
+    meta = dict(meta, key=key, byteorder=sys.byteorder, arrays={})
+    blobs = []
+    offset = HEADER.size
+    for name, values in arrays:
+        data = values.tobytes()
+        padding = -len(data) % 8
+        meta['arrays'][name] = [offset, values.typecode, len(values)]
+        blobs.append(data + b'\0' * padding)
+        offset += len(data) + padding
+    meta = json.dumps(meta).encode('utf-8')
+
+    directory = os.path.dirname(path)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, offset, len(meta)))
+            for blob in blobs:
+                f.write(blob)
+            f.write(meta)
+        os.replace(tmp_path, path)
+    except (IOError, OSError):
+        # the cache is only an optimization, a read-only or full disk
+        # must not stop the caller from using what it just built
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    return True
+
+
+def read_cache(path, key):
+    try:
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None
+    if len(buf) < HEADER.size:
+        return None
+    magic, version, meta_offset, meta_len = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != VERSION:
+        return None
+    try:
+        meta = json.loads(buf[meta_offset:meta_offset + meta_len]
+                          .decode('utf-8'))
+    except ValueError:
+        return None
+    if meta.get('key') != key or meta.get('byteorder') != sys.byteorder:
+        return None
+    view = memoryview(buf)
+    arrays = {}
+    for name, (offset, typecode, length) in meta['arrays'].items():
+        size = array(typecode).itemsize * length
+        arrays[name] = view[offset:offset + size].cast(typecode)
+    return meta, arrays
+
+
+def save_dfa(token_base, dfa, cache_dir):
+    key = token_base_key(token_base)
+    meta = {'tokens': [token.__name__ for token in dfa.tokens],
+            'nclasses': dfa.nclasses}
+    arrays = [('bounds', dfa.bounds), ('bound_classes', dfa.bound_classes),
+              ('trans', dfa.trans), ('accept', dfa.accept)]
+    return write_cache(cache_path(cache_dir, 'tokens', key), key,
+                       meta, arrays)
+
+
+def load_dfa(token_base, cache_dir):
+    key = token_base_key(token_base)
+    entry = read_cache(cache_path(cache_dir, 'tokens', key), key)
+    if entry is None:
+        return None
+    meta, arrays = entry
+    tokens = [token_base.__tokens__[name] for name in meta['tokens']]
+    ignore = bytearray(1 if token.ignore else 0 for token in tokens)
+    return DFATable(arrays['bounds'], arrays['bound_classes'],
+                    meta['nclasses'], arrays['trans'], arrays['accept'],
+                    tokens, ignore)
+
+
+def dump_rule_dfa(start, rule_base):
+    states = [start]
+    index = {start: 0}
+    for state in states:
+        for dst in state.arcs.values():
+            if dst not in index:
+                index[dst] = len(states)
+                states.append(dst)
+    dumped = []
+    for state in states:
+        arcs = []
+        for label, dst in state.arcs.items():
+            if isinstance(label, type):
+                kind = 'r' if issubclass(label, rule_base) else 't'
+                arcs.append([kind, label.__name__, index[dst]])
+            else:
+                arcs.append(['s', label, index[dst]])
+        dumped.append([state.is_final, arcs])
+    return dumped
+
+
+def load_rule_dfa(dumped, rulecls, token_base, rules):
+    states = [DFAState() for _ in dumped]
+    for state, (is_final, arcs) in zip(states, dumped):
+        state.is_final = is_final
+        if is_final:
+            state.data = rulecls
+        for kind, value, dst in arcs:
+            if kind == 't':
+                label = token_base.__tokens__[value]
+            elif kind == 'r':
+                label = rules[value]
+            else:
+                label = value
+            state.arcs[label] = states[dst]
+    return states[0]
+
+
+def save_rules(token_base, grammar, rules, cache_dir, rule_base):
+    key = grammar_key(token_base, grammar)
+    meta = {'rules': [[name, dump_rule_dfa(rulecls.root, rule_base)]
+                      for name, rulecls in rules.items()]}
+    return write_cache(cache_path(cache_dir, 'grammar', key), key, meta, [])
+
+
+def load_rules(token_base, grammar, cache_dir, rule_base):
+    key = grammar_key(token_base, grammar)
+    entry = read_cache(cache_path(cache_dir, 'grammar', key), key)
+    if entry is None:
+        return None
+    meta, _ = entry
+    rules = {}
+    for name, _ in meta['rules']:
+        rules[name] = type(str(name), (rule_base,), {})
+    for name, dumped in meta['rules']:
+        rules[name].root = load_rule_dfa(
+            dumped, rules[name], token_base, rules)
+    return rules
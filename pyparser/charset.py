@@ -0,0 +1,114 @@
+from bisect import bisect_right
+
+
+MAX_CHAR = 0x110000
+
+
+def _combine(a, b, op):
+    # sweep the boundaries of `a` and `b`, keeping the points where
+    # op(in_a, in_b) changes
+    bounds = []
+    inside = False
+    for point in sorted(set(a).union(b)):
+        now = op(bisect_right(a, point) & 1, bisect_right(b, point) & 1)
+        if now != inside:
+            bounds.append(point)
+            inside = now
+    return tuple(bounds)
+
+
+class CharSet(object):
+    # sorted disjoint half-open code point intervals, stored flat as
+    # (lo0, hi0, lo1, hi1, ...)
+    __slots__ = ['bounds']
+
+    def __init__(self, chars='', ranges=()):
+        points = set()
+        for char in chars:
+            points.add(ord(char))
+        bounds = []
+        for lo, hi in sorted([(x, x + 1) for x in points] +
+                             [(ord(lo), ord(hi) + 1) for lo, hi in ranges]):
+            if lo >= hi:
+                raise ValueError('invalid range')
+            if bounds and lo <= bounds[-1]:
+                bounds[-1] = max(bounds[-1], hi)
+            else:
+                bounds.extend((lo, hi))
+        self.bounds = tuple(bounds)
+
+    @classmethod
+    def from_bounds(cls, bounds):
+        charset = cls.__new__(cls)
+        charset.bounds = tuple(bounds)
+        return charset
+
+    def __contains__(self, char):
+        return bisect_right(self.bounds, ord(char)) & 1 == 1
+
+    def __len__(self):
+        bounds = self.bounds
+        return sum(bounds[i + 1] - bounds[i] for i in range(0, len(bounds), 2))
+
+    def __bool__(self):
+        return len(self.bounds) != 0
+
+    __nonzero__ = __bool__
+
+    def __iter__(self):
+        bounds = self.bounds
+        for i in range(0, len(bounds), 2):
+            for x in range(bounds[i], bounds[i + 1]):
+                yield chr(x)
+
+    def intervals(self):
+        bounds = self.bounds
+        for i in range(0, len(bounds), 2):
+            yield chr(bounds[i]), chr(bounds[i + 1] - 1)
+
+    def union(self, other):
+        return CharSet.from_bounds(
+            _combine(self.bounds, other.bounds, lambda a, b: a or b))
+
+    def intersection(self, other):
+        return CharSet.from_bounds(
+            _combine(self.bounds, other.bounds, lambda a, b: a and b))
+
+    def difference(self, other):
+        return CharSet.from_bounds(
+            _combine(self.bounds, other.bounds, lambda a, b: a and not b))
+
+    def complement(self):
+        return CharSet.from_bounds(
+            _combine((0, MAX_CHAR), self.bounds, lambda a, b: a and not b))
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+    __invert__ = complement
+
+    def __hash__(self):
+        return hash((self.__class__, self.bounds))
+
+    def __eq__(self, other):
+        return (other.__class__ is self.__class__ and
+                other.bounds == self.bounds)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        parts = []
+        for lo, hi in self.intervals():
+            parts.append(repr(lo) if lo == hi else '%r-%r' % (lo, hi))
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(parts))
+
+
+class NegLabel(CharSet):
+    # the complement of a `[^...]` class. it is a plain CharSet except
+    # that positive arcs out of the same DFA state shadow it
+    __slots__ = []
+
+    def __init__(self, chars='', ranges=()):
+        excluded = CharSet(chars, ranges)
+        self.bounds = excluded.complement().bounds
@@ -0,0 +1,234 @@
+import types
+
+from .charset import MAX_CHAR
+
+
+# a generated module only needs a str to scan, it doesn't import pyparser
+HEADER = '''# generated by pyparser.codegen from %(base)s, do not edit
+
+TOKENS = %(tokens)r
+IGNORE = %(ignore)r
+# kind: ({text: kind}, {lowercased text: kind}) of keyword tokens
+KEYWORDS = %(keywords)r
+
+
+class TokenizeError(ValueError):
+
+    def __init__(self, offset, char=None):
+        ValueError.__init__(self, offset, char)
+        self.offset = offset
+        self.char = char
+
+    def __str__(self):
+        if self.char is None:
+            return 'unexpected end at %%d' %% self.offset
+        return 'unexpected char at %%d %%r' %% (self.offset, self.char)
+
+
+def keyword(kind, text):
+    exact, folded = KEYWORDS[kind]
+    found = exact.get(text, None)
+    if found is None and folded:
+        found = folded.get(text.lower(), None)
+    return kind if found is None else found
+
+'''
+
+SCAN_HEAD = '''
+def scan(data, i=0, end=None):
+    # yields (kind, start, end) of the non-ignored tokens of data[i:end],
+    # kind indexes TOKENS. longest match first
+    if end is None:
+        end = len(data)
+    state = 1
+    start = i
+    last_kind = -1
+    last_end = i
+    while True:
+'''
+
+SCAN_TAIL = '''        # the token can't go on: back to its longest match
+        if last_kind < 0:
+            if i < end:
+                raise TokenizeError(i, data[i])
+            if i == start:
+                return
+            raise TokenizeError(i)
+        if not IGNORE[last_kind]:
+            if last_kind in KEYWORDS:
+                last_kind = keyword(last_kind, data[start:last_end])
+            yield last_kind, start, last_end
+        i = start = last_end
+        state = 1
+        last_kind = -1
+
+
+def tokens(data):
+    for kind, start, end in scan(data):
+        yield TOKENS[kind], data[start:end]
+'''
+
+# sets with more parts than this are tested with a frozenset constant
+MAX_TESTS = 2
+
+
+def class_intervals(dfa):
+    # [(lo, hi)] code point intervals, hi included, of each char class
+    intervals = [[] for _ in range(dfa.nclasses)]
+    bounds = list(dfa.bounds) + [MAX_CHAR]
+    for k, c in enumerate(dfa.bound_classes):
+        if bounds[k] < bounds[k + 1]:
+            intervals[c].append((bounds[k], bounds[k + 1] - 1))
+    return intervals
+
+
+def merge(intervals):
+    merged = []
+    for lo, hi in sorted(intervals):
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+def complement(intervals):
+    result = []
+    lo = 0
+    for a, b in intervals:
+        if a > lo:
+            result.append((lo, a - 1))
+        lo = b + 1
+    if lo < MAX_CHAR:
+        result.append((lo, MAX_CHAR - 1))
+    return result
+
+
+class SourceWriter(object):
+
+    def __init__(self, dfa, name):
+        self.dfa = dfa
+        self.name = name
+        self.intervals = class_intervals(dfa)
+        self.constants = []
+
+    def parts(self, intervals):
+        # comparisons testing `c`: chars of short runs go in one string
+        chars = ''
+        ranges = []
+        for lo, hi in intervals:
+            if hi - lo < 3:
+                chars += ''.join(chr(x) for x in range(lo, hi + 1))
+            else:
+                ranges.append('%r <= c <= %r' % (chr(lo), chr(hi)))
+        if len(chars) == 1:
+            return ['c == %r' % chars] + ranges
+        if chars:
+            return ['c in %r' % chars] + ranges
+        return ranges
+
+    def test(self, intervals):
+        # a python expression true when `c` is in `intervals`
+        size = sum(hi - lo + 1 for lo, hi in intervals)
+        inverse = complement(intervals)
+        if not intervals:
+            return 'False'
+        if not inverse:
+            return 'True'
+        parts = self.parts(intervals)
+        inverse_parts = self.parts(inverse)
+        if len(inverse_parts) < len(parts):
+            if len(inverse_parts) > 1:
+                return 'not (%s)' % ' or '.join(inverse_parts)
+            part = inverse_parts[0]
+            if part.startswith('c == '):
+                return 'c != ' + part[5:]
+            if part.startswith('c in '):
+                return 'c not in ' + part[5:]
+            return 'not %s' % part
+        if len(parts) > MAX_TESTS and size <= 1024:
+            name = 'C%d' % len(self.constants)
+            chars = ''.join(chr(x) for lo, hi in intervals
+                            for x in range(lo, hi + 1))
+            self.constants.append('%s = frozenset(%r)' % (name, chars))
+            return 'c in %s' % name
+        return ' or '.join(parts)
+
+    def state_block(self, state, first):
+        dfa = self.dfa
+        nclasses = dfa.nclasses
+        targets = {}
+        for c in range(nclasses):
+            dst = dfa.trans[state * nclasses + c]
+            if dst > 0:
+                targets.setdefault(dst, []).extend(self.intervals[c])
+        lines = ['        %s state == %d:' % ('if' if first else 'elif',
+                                               state)]
+        loop = targets.pop(state, None)
+        if loop is not None and not complement(merge(loop)):
+            # the loop takes every char
+            lines += ['            i = end']
+        elif loop is not None:
+            lines += ['            while i < end:',
+                      '                c = data[i]',
+                      '                if %s:' % self.test(
+                          complement(merge(loop))),
+                      '                    break',
+                      '                i += 1']
+        if dfa.accept[state] >= 0:
+            lines += ['            last_kind = %d' % dfa.accept[state],
+                      '            last_end = i']
+        if targets:
+            lines += ['            if i < end:',
+                      '                c = data[i]']
+            # the widest sets last, they are the slowest to test
+            order = sorted(targets.items(),
+                           key=lambda item: (len(item[1]), item[0]))
+            for k, (dst, intervals) in enumerate(order):
+                lines += ['                %s %s:' % (
+                              'if' if k == 0 else 'elif',
+                              self.test(merge(intervals))),
+                          '                    state = %d' % dst,
+                          '                    i += 1',
+                          '                    continue']
+        if len(lines) == 1:
+            lines.append('            pass')
+        return lines
+
+    def source(self):
+        dfa = self.dfa
+        blocks = []
+        for state in range(1, dfa.nstates):
+            blocks += self.state_block(state, state == 1)
+        header = HEADER % {
+            'base': self.name,
+            'tokens': tuple(token.__name__ for token in dfa.tokens),
+            'ignore': tuple(bool(x) for x in dfa.ignore),
+            'keywords': dfa.keywords}
+        constants = ''.join(line + '\n' for line in self.constants)
+        return (header + constants + SCAN_HEAD +
+                ''.join(line + '\n' for line in blocks) + SCAN_TAIL)
+
+
+def generate_source(token_base):
+    # python source of a module scanning with the token base's DFA
+    dfa = token_base.compile_dfa()
+    module = dfa.tokens[0].__module__ if dfa.tokens else __name__
+    name = '%s.%s' % (module, token_base.__name__)
+    return SourceWriter(dfa, name).source()
+
+
+def compile_module(token_base, name=None):
+    # the generated module, compiled in memory
+    if name is None:
+        name = '%s_scanner' % token_base.__name__.lower()
+    module = types.ModuleType(name)
+    code = compile(generate_source(token_base), '<%s>' % name, 'exec')
+    exec(code, module.__dict__)
+    return module
+
+
+def write_module(token_base, path):
+    # the generated module as a file, to import without pyparser
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(generate_source(token_base))
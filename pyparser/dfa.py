@@ -1,98 +1,196 @@
+import time
+from array import array
+from bisect import bisect_left, bisect_right
 from collections import defaultdict
 
+from .charset import CharSet, NegLabel, MAX_CHAR
+
 
 class NFAState(object):
+    # `arena` is the list of the states of one NFA build, a state's id is
+    # its index there. arcs maps a label to the list of its targets
     __slots__ = ['arcs', 'is_final', 'id', 'data']
-    _auto_id = 0
 
-    def __init__(self):
-        self.arcs = defaultdict(lambda: [])
+    def __init__(self, arena):
+        self.arcs = {}
         self.is_final = False
         self.data = None
-        self.id = self.get_id()
+        self.id = len(arena)
+        arena.append(self)
 
     def __hash__(self):
         return self.id
 
-    @classmethod
-    def get_id(cls):
-        cls._auto_id += 1
-        return cls._auto_id - 1
-
     def arc(self, label, node):
         assert node is not None
-        self.arcs[label].append(node)
+        nfa_dsts = self.arcs.get(label, None)
+        if nfa_dsts is None:
+            self.arcs[label] = [node]
+        else:
+            nfa_dsts.append(node)
         return node
 
 
-class NegLabel(object):
-    __slots__ = ['labels']
+def nfa_states(starts):
+    states = list(starts)
+    seen = set(nfa.id for nfa in states)
+    for nfa in states:
+        for nfa_dsts in nfa.arcs.values():
+            for dst in nfa_dsts:
+                if dst.id not in seen:
+                    seen.add(dst.id)
+                    states.append(dst)
+    return states
 
-    def __init__(self, labels):
-        self.labels = set(labels)
 
-    def __hash__(self):
-        return id(self)
+EMPTY_MOVES = ({}, {})
+
+
+def is_char_nfa(start_nfa):
+    for nfa in nfa_states([start_nfa]):
+        for label in nfa.arcs:
+            if isinstance(label, CharSet):
+                return True
+    return False
+
+
+class CharClasses(object):
+    # alphabet partition: chars taking the same arcs out of every NFA
+    # state share one class, class 0 holds every char no label covers.
+    # a class is a union of intervals, chars of [bounds[i], bounds[i+1])
+    # are in classes[i]. `moves` maps an NFA id to its (positive,
+    # negated) arcs by class
+    __slots__ = ['bounds', 'classes', 'count', 'moves']
 
-    def join(self, other):
-        if not isinstance(other, NegLabel):
-            raise Exception('invalid NegLabel')
-        self.labels = self.labels.intersection(other.labels)
+    def __init__(self, starts):
+        states = nfa_states(starts)
+        arcs = []
+        points = set([0])
+        for nfa in states:
+            for label, nfa_dsts in nfa.arcs.items():
+                if isinstance(label, CharSet):
+                    arcs.append((nfa, label, nfa_dsts))
+                    points.update(label.bounds)
+        points.discard(MAX_CHAR)
+        points = sorted(points)
 
-    def __eq__(self, other):
-        return self.labels == other.labels
+        signatures = [[] for _ in points]
+        arc_segments = []
+        for n, (nfa, label, nfa_dsts) in enumerate(arcs):
+            segments = []
+            bounds = label.bounds
+            for i in range(0, len(bounds), 2):
+                segments.extend(range(bisect_left(points, bounds[i]),
+                                      bisect_left(points, bounds[i + 1])))
+            for segment in segments:
+                signatures[segment].append(n)
+            arc_segments.append(segments)
+
+        class_ids = {(): 0}
+        segment_classes = [
+            class_ids.setdefault(tuple(signature), len(class_ids))
+            for signature in signatures]
+        self.count = len(class_ids)
+        self.bounds = []
+        self.classes = []
+        for point, c in zip(points, segment_classes):
+            if not self.classes or self.classes[-1] != c:
+                self.bounds.append(point)
+                self.classes.append(c)
+
+        self.moves = {}
+        for (nfa, label, nfa_dsts), segments in zip(arcs, arc_segments):
+            moves = self.moves.get(nfa.id, None)
+            if moves is None:
+                moves = self.moves[nfa.id] = ({}, {})
+            moves = moves[1 if isinstance(label, NegLabel) else 0]
+            for c in set(segment_classes[segment] for segment in segments):
+                moves.setdefault(c, []).extend(nfa_dsts)
+
+    def get(self, char):
+        return self.classes[bisect_right(self.bounds, ord(char)) - 1]
+
+    def partition(self):
+        # the same classes without `moves`, which hold the NFA states
+        copy = CharClasses.__new__(CharClasses)
+        copy.bounds = self.bounds
+        copy.classes = self.classes
+        copy.count = self.count
+        copy.moves = None
+        return copy
+
+    def charset(self, c):
+        bounds = []
+        for i, (point, cls) in enumerate(zip(self.bounds, self.classes)):
+            if cls == c:
+                end = (self.bounds[i + 1] if i + 1 < len(self.bounds)
+                       else MAX_CHAR)
+                if bounds and bounds[-1] == point:
+                    bounds[-1] = end
+                else:
+                    bounds.extend((point, end))
+        return CharSet.from_bounds(bounds)
 
 
 class DFAState(object):
-    __slots__ = ['states', 'ids', 'arc_labels',
-                 'is_final', 'arcs', 'neg_label',
-                 'neg_state', 'data']
+    # a DFA built over char classes keeps them in `classes`, its arcs are
+    # keyed by class id and `next` takes a char
+    __slots__ = ['arc_labels', 'is_final', 'arcs', 'classes', 'data']
 
-    def __init__(self):
-        self.states = []
+    def __init__(self, classes=None):
         self.arc_labels = set()
         self.arcs = {}
         self.is_final = False
-        self.neg_label = None
-        self.neg_state = None
+        self.classes = classes
         self.data = None
-        self.ids = set()
 
     def next(self, label):
-        state = self.arcs.get(label, None)
-        if state is None:
-            if self.neg_state is not None:
-                if label not in self.neg_label.labels:
-                    state = self.neg_state
-        return state
+        if self.classes is not None:
+            label = self.classes.get(label)
+        return self.arcs.get(label, None)
+
+    def add_nfa(self, nfa):
+        # `nfa` is a member no other add has given
+        if nfa.is_final:
+            self.is_final = True
+            if self.data is not None and self.data is not nfa.data:
+                raise Exception('state accept the same data')
+            self.data = nfa.data
 
     def add(self, *nfas):
         for nfa in nfas:
-            if nfa.id not in self.ids:
-                self.states.append(nfa)
-                self.ids.add(nfa.id)
-                if nfa.is_final:
-                    self.is_final = True
-                    if self.data is not None and self.data is not nfa.data:
-                        raise Exception('state accept the same data')
-                    self.data = nfa.data
-                for label, nfa_dsts in nfa.arcs.items():
-                    if label is None:
-                        continue
-                    if isinstance(label, NegLabel):
-                        if self.neg_label is not None:
-                            self.neg_label.join(label)
-                            self.neg_state.extend(nfa_dsts)
-                            continue
-                        self.neg_label = label
-                        self.neg_state = nfa_dsts[:]
-                        self.arcs[label] = self.neg_state
-                    else:
-                        nfas = self.arcs.get(label, None)
-                        if nfas is None:
-                            self.arcs[label] = nfa_dsts[:]
-                        else:
-                            nfas.extend(nfa_dsts)
+            self.add_nfa(nfa)
+            for label, nfa_dsts in nfa.arcs.items():
+                if label is None:
+                    continue
+                nfas = self.arcs.get(label, None)
+                if nfas is None:
+                    self.arcs[label] = nfa_dsts[:]
+                else:
+                    nfas.extend(nfa_dsts)
+
+    def add_classes(self, *nfas):
+        # a class covered by any positive label shadows the negated
+        # labels, so `[^']` only takes the chars no other arc wants
+        neg = {}
+        for nfa in nfas:
+            self.add_nfa(nfa)
+            pos_moves, neg_moves = self.classes.moves.get(nfa.id, EMPTY_MOVES)
+            for c, nfa_dsts in pos_moves.items():
+                dsts = self.arcs.get(c, None)
+                if dsts is None:
+                    self.arcs[c] = nfa_dsts[:]
+                else:
+                    dsts.extend(nfa_dsts)
+            for c, nfa_dsts in neg_moves.items():
+                dsts = neg.get(c, None)
+                if dsts is None:
+                    neg[c] = nfa_dsts[:]
+                else:
+                    dsts.extend(nfa_dsts)
+        for c, nfa_dsts in neg.items():
+            if c not in self.arcs:
+                self.arcs[c] = nfa_dsts
 
     def out_equals(self, other):
         if self.is_final != other.is_final:
@@ -107,8 +205,6 @@ class DFAState(object):
         return True
 
     def replace(self, fr, to):
-        if self.neg_state is fr:
-            self.neg_state = to
         for label, state in self.arcs.items():
             if state is fr:
                 self.arcs[label] = to
@@ -129,66 +225,460 @@ def simplify_dfa(states):
                     break
 
 
+def dfa_alphabet(states):
+    symbols = set()
+    for state in states:
+        symbols.update(state.arcs)
+    return list(symbols)
+
+
+def minimize_dfa(states):
+    # Hopcroft partition refinement, O(n*k*log(n)).
+    # index len(states) is the implicit dead state missing arcs lead to
+    symbols = dfa_alphabet(states)
+    index = dict((state, i) for i, state in enumerate(states))
+    dead = len(states)
+    inverse = []
+    for symbol in symbols:
+        inv = defaultdict(list)
+        for i, state in enumerate(states):
+            dst = state.arcs.get(symbol, None)
+            inv[dead if dst is None else index[dst]].append(i)
+        inv[dead].append(dead)
+        inverse.append(inv)
+
+    groups = {}
+    for i, state in enumerate(states):
+        groups.setdefault((state.is_final, state.data), set()).add(i)
+    groups.setdefault((False, None), set()).add(dead)
+    blocks = list(groups.values())
+    block_of = [0] * (dead + 1)
+    for b, block in enumerate(blocks):
+        for i in block:
+            block_of[i] = b
+
+    pending = list(range(len(blocks)))
+    waiting = set(pending)
+    while pending:
+        b = pending.pop()
+        waiting.discard(b)
+        splitter = list(blocks[b])
+        for inv in inverse:
+            touched = {}
+            for dst in splitter:
+                for src in inv.get(dst, ()):
+                    touched.setdefault(block_of[src], set()).add(src)
+            for b, hit in touched.items():
+                block = blocks[b]
+                if len(hit) == len(block):
+                    continue
+                # the split costs O(len(hit)): `hit` leaves the block and
+                # only its states are relabeled
+                block -= hit
+                new_b = len(blocks)
+                blocks.append(hit)
+                for i in hit:
+                    block_of[i] = new_b
+                # either b is still pending (and so must be its new half)
+                # or the smaller half is enough to split the others
+                if b in waiting or len(hit) <= len(block):
+                    pending.append(new_b)
+                    waiting.add(new_b)
+                else:
+                    pending.append(b)
+                    waiting.add(b)
+
+    dead_block = block_of[dead]
+    start = states[0]
+    if block_of[0] == dead_block:
+        start.arcs = {}
+        states[:] = [start]
+        return states
+
+    reps = {}
+    kept = []
+    for i, state in enumerate(states):
+        b = block_of[i]
+        if b != dead_block and b not in reps:
+            reps[b] = state
+            kept.append(state)
+
+    def rep(state):
+        if state is None:
+            return None
+        return reps.get(block_of[index[state]], None)
+
+    for state in kept:
+        arcs = {}
+        for label, dst in state.arcs.items():
+            dst = rep(dst)
+            if dst is not None:
+                arcs[label] = dst
+        state.arcs = arcs
+    states[:] = kept
+    return states
+
+
 def epsilon_closure(nfa, eps):
     eps.add(nfa)
-    if None in nfa.arcs:
-        for nfa_dst in nfa.arcs[None]:
+    stack = [nfa]
+    while stack:
+        for nfa_dst in stack.pop().arcs.get(None, ()):
             if nfa_dst not in eps:
-                epsilon_closure(nfa_dst, eps)
+                eps.add(nfa_dst)
+                stack.append(nfa_dst)
     return eps
 
 
-def epsilon_closure_set(nfas, boost, eps):
-    ids = set()
-    for nfa in nfas:
-        cache = boost.get(nfa.id, None)
-        if cache is None:
-            cache = epsilon_closure(nfa, set())
-            boost[nfa.id] = cache
-        ids.update([x.id for x in cache])
-        eps.update(cache)
+class NFASets(object):
+    # sets of NFA states as frozensets of dense numbers: state k is
+    # `states[k]`, states are numbered as the closures first reach them.
+    # states with only epsilon arcs and no token to accept are left out,
+    # they don't change what the set does. `boost` caches the closure of
+    # each single NFA state by id, a set of several is walked at once so
+    # states their closures share are visited one time
+    __slots__ = ['boost', 'ids', 'states', 'stats']
 
-    return '.'.join([str(x) for x in ids]), eps
+    def __init__(self, stats=None):
+        self.boost = {}
+        self.ids = {}
+        self.states = []
+        self.stats = stats
+
+    def closure(self, nfas):
+        if len(nfas) == 1:
+            key = self.boost.get(nfas[0].id, None)
+            if key is not None:
+                if self.stats is not None:
+                    self.stats.closure_hits += 1
+                return key
+        seen = set()
+        stack = []
+        for nfa in nfas:
+            if nfa.id not in seen:
+                seen.add(nfa.id)
+                stack.append(nfa)
+        numbers = []
+        while stack:
+            member = stack.pop()
+            eps = member.arcs.get(None, ())
+            for nfa_dst in eps:
+                if nfa_dst.id not in seen:
+                    seen.add(nfa_dst.id)
+                    stack.append(nfa_dst)
+            labels = len(member.arcs) - (None in member.arcs)
+            if not labels and not member.is_final:
+                continue
+            k = self.ids.get(member.id, None)
+            if k is None:
+                k = self.ids[member.id] = len(self.states)
+                self.states.append(member)
+            numbers.append(k)
+        key = frozenset(numbers)
+        if len(nfas) == 1:
+            self.boost[nfas[0].id] = key
+        if self.stats is not None:
+            self.stats.closure_misses += 1
+        return key
 
+    def members(self, key):
+        states = self.states
+        return [states[k] for k in key]
 
-def nfa2dfa(start_nfa):
-    boost = {}
-    start = DFAState()
-    eps = epsilon_closure(start_nfa, set())
-    boost[start_nfa.id] = eps
-    start.add(*eps)
-    ids = '.'.join([str(x) for x in start.ids])
-    boost[ids] = start
+
+def nfa2dfa(start_nfa, legacy_simplify=False, classes=None, stats=None):
+    # NFAs over CharSet labels are run over char classes (CharClasses),
+    # any other label is taken as an opaque symbol. DFA states are found
+    # by the NFASets key of their NFA states. `stats`, a BuildStats, gets
+    # the state counts and cache hits
+    if stats is not None:
+        stats.nfa_states += len(nfa_states([start_nfa]))
+        start_time = time.perf_counter()
+    if classes is None and is_char_nfa(start_nfa):
+        classes = CharClasses([start_nfa])
+    sets = NFASets(stats)
+    key = sets.closure([start_nfa])
+    start = DFAState(classes)
+    if classes is None:
+        start.add(*sets.members(key))
+    else:
+        start.add_classes(*sets.members(key))
+    index = {key: start}
 
     states = [start]
     for cur in states:
         arcs = {}
         for label, nfas in cur.arcs.items():
-            ids, eps = epsilon_closure_set(nfas, boost, set())
-            dfa = boost.get(ids, None)
+            key = sets.closure(nfas)
+            dfa = index.get(key, None)
+            if dfa is not None and stats is not None:
+                stats.subset_hits += 1
             if dfa is None:
-                dfa = DFAState()
-                dfa.add(*eps)
-                boost[ids] = dfa
+                dfa = DFAState(classes)
+                if classes is None:
+                    dfa.add(*sets.members(key))
+                else:
+                    dfa.add_classes(*sets.members(key))
+                index[key] = dfa
                 states.append(dfa)
             arcs[label] = dfa
-        if cur.neg_label is not None:
-            cur.neg_state = arcs[cur.neg_label]
         cur.arcs = arcs
-    simplify_dfa(states)
+    if stats is not None:
+        start_time = stats.lap('subset', start_time)
+        stats.dfa_states += len(states)
+    if legacy_simplify:
+        simplify_dfa(states)
+    else:
+        minimize_dfa(states)
+    if stats is not None:
+        stats.lap('simplify' if legacy_simplify else 'minimize', start_time)
+        stats.min_states += len(states)
+    if classes is not None:
+        # the DFA keeps no reference to the NFA
+        partition = classes.partition()
+        for state in states:
+            state.classes = partition
     return start
 
 
+class DFATable(object):
+    # flat form of a token DFA: state 0 is the dead state and 1 the start
+    # state, the next state of `s` on char class `c` is
+    # trans[s * nclasses + c]. `classes` caches the class of every char
+    # seen so far, `char_class` bisects the class intervals for the rest.
+    # bytes are scanned as latin-1: `classes` also maps the ints 0-255.
+    # `keywords` is keyword_tables(tokens)
+    __slots__ = ['classes', 'bounds', 'bound_classes', 'nclasses',
+                 'trans', 'accept', 'tokens', 'ignore', 'keywords']
+    # how many times the states were renumbered, see LazyDFATable
+    flushes = 0
+
+    def __init__(self, bounds, bound_classes, nclasses,
+                 trans, accept, tokens, ignore):
+        self.bounds = bounds
+        self.bound_classes = bound_classes
+        self.nclasses = nclasses
+        self.trans = trans
+        self.accept = accept
+        self.tokens = tokens
+        self.ignore = ignore
+        self.keywords = keyword_tables(tokens)
+        self.classes = {}
+        for x in range(256):
+            self.classes[x] = self.char_class(chr(x))
+
+    def __getstate__(self):
+        # tables loaded from a cache file are views of an mmap
+        state = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if isinstance(value, memoryview):
+                value = array(value.format, value.tobytes())
+            state[name] = value
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    @property
+    def nstates(self):
+        return len(self.accept)
+
+    def char_class(self, char):
+        c = self.bound_classes[bisect_right(self.bounds, ord(char)) - 1]
+        self.classes[char] = c
+        return c
+
+    def next(self, state, char):
+        c = self.classes.get(char, None)
+        if c is None:
+            c = self.char_class(char)
+        return self.trans[state * self.nclasses + c]
+
+    def lookahead(self):
+        # how many chars past the end of a token a scan may read to know
+        # it ends there: the longest run of non-accepting states after an
+        # accepting one plus the char it dies on. None if there's no
+        # bound, a non-accepting loop can follow a token
+        nclasses = self.nclasses
+        trans = self.trans
+        accept = self.accept
+
+        def targets(state):
+            row = trans[state * nclasses:(state + 1) * nclasses]
+            return set(dst for dst in row if dst > 0 and accept[dst] < 0)
+
+        # the longest non-accepting run from a state, None while walking it
+        depth = {}
+        reads = 1
+        for state in range(1, self.nstates):
+            if accept[state] < 0:
+                continue
+            for root in targets(state):
+                if root not in depth:
+                    depth[root] = None
+                    pending = [(root, list(targets(root)))]
+                    while pending:
+                        top, rest = pending[-1]
+                        if rest:
+                            dst = rest.pop()
+                            if dst not in depth:
+                                depth[dst] = None
+                                pending.append((dst, list(targets(dst))))
+                            elif depth[dst] is None:
+                                return None
+                        else:
+                            pending.pop()
+                            depth[top] = 1 + max([depth[dst] for dst
+                                                  in targets(top)] or [0])
+                reads = max(reads, depth[root] + 1)
+        return reads
+
+
+def keyword_tables(tokens):
+    # {kind: (exact, folded)} for the kinds keyword tokens are taken from
+    # (their `keyword_of`): the kind a text of that kind becomes, looked
+    # up in `exact` as it is and in `folded` lowercased
+    kinds = dict((token, kind) for kind, token in enumerate(tokens))
+    tables = {}
+    for kind, token in enumerate(tokens):
+        of = kinds.get(token.keyword_of, None)
+        if not token.keywords or of is None:
+            continue
+        exact, folded = tables.setdefault(of, ({}, {}))
+        table = folded if token.ignore_case else exact
+        for word in token.keywords:
+            if token.ignore_case:
+                word = word.lower()
+            if table.get(word, kind) != kind:
+                raise Exception('keyword %r in %s and %s' % (
+                    word, tokens[table[word]].__name__, token.__name__))
+            table[word] = kind
+    return tables
+
+
+def compile_dfa(start, classes, tokens):
+    # `start` is a DFA built by nfa2dfa over `classes`
+    states = [start]
+    index = {start: 1}
+    for state in states:
+        for dst in state.arcs.values():
+            if dst not in index:
+                index[dst] = len(states) + 1
+                states.append(dst)
+
+    nclasses = classes.count
+    kinds = dict((token, kind) for kind, token in enumerate(tokens))
+    trans = array('i', [0]) * ((len(states) + 1) * nclasses)
+    accept = array('h', [-1])
+    for state in states:
+        row = index[state] * nclasses
+        for c, dst in state.arcs.items():
+            trans[row + c] = index[dst]
+        accept.append(kinds[state.data] if state.is_final else -1)
+    ignore = bytearray(1 if token.ignore else 0 for token in tokens)
+    return DFATable(array('I', classes.bounds), array('i', classes.classes),
+                    nclasses, trans, accept, list(tokens), ignore)
+
+
+class LazyDFATable(DFATable):
+    # DFATable whose states are built the first time the input reaches
+    # them, a trans entry of -1 is not computed yet (see `expand`). when
+    # more than `max_states` are built the whole cache is dropped and
+    # refilled from the start state, as RE2 does. the tables are reset
+    # in place, so loops holding `trans` or `accept` stay valid
+    __slots__ = ['moves', 'kinds', 'max_states', 'start', 'sets', 'index',
+                 'nfa_sets', 'flushes']
+
+    def __init__(self, start_nfa, classes, tokens, max_states=10000):
+        tokens = list(tokens)
+        ignore = bytearray(1 if token.ignore else 0 for token in tokens)
+        DFATable.__init__(self, array('I', classes.bounds),
+                          array('i', classes.classes), classes.count,
+                          array('i'), array('h'), tokens, ignore)
+        self.moves = classes.moves
+        self.kinds = dict((token, kind) for kind, token in enumerate(tokens))
+        self.max_states = max(max_states, 3)
+        self.nfa_sets = NFASets()
+        self.sets = []
+        self.index = {}
+        self.flushes = 0
+        self.start = self.nfa_sets.closure([start_nfa])
+        self.flush()
+        if self.accept[1] >= 0:
+            raise Exception('invalid token, accept empty string: %s' %
+                            tokens[self.accept[1]].__name__)
+
+    def flush(self):
+        del self.trans[:]
+        del self.accept[:]
+        del self.sets[:]
+        self.index.clear()
+        self.trans.extend(array('i', [0]) * self.nclasses)
+        self.accept.append(-1)
+        self.sets.append(())
+        self.add_state(self.start)
+
+    def add_state(self, key):
+        members = self.nfa_sets.members(key)
+        data = None
+        for nfa in members:
+            if nfa.is_final:
+                if data is not None and data is not nfa.data:
+                    raise Exception('state accept the same data')
+                data = nfa.data
+        state = len(self.accept)
+        self.index[key] = state
+        self.sets.append(members)
+        self.accept.append(-1 if data is None else self.kinds[data])
+        self.trans.extend(array('i', [-1]) * self.nclasses)
+        return state
+
+    def expand(self, state, c):
+        pos = []
+        neg = []
+        for nfa in self.sets[state]:
+            moves = self.moves.get(nfa.id, None)
+            if moves is not None:
+                pos.extend(moves[0].get(c, ()))
+                neg.extend(moves[1].get(c, ()))
+        # positive arcs shadow negated ones, as in DFAState.add_classes
+        dsts = pos or neg
+        if not dsts:
+            target = 0
+        else:
+            key = self.nfa_sets.closure(dsts)
+            target = self.index.get(key, None)
+            if target is None:
+                if len(self.accept) >= self.max_states:
+                    self.flush()
+                    self.flushes += 1
+                    # `state` is gone, only the target is cached
+                    return self.add_state(key)
+                target = self.add_state(key)
+        self.trans[state * self.nclasses + c] = target
+        return target
+
+    def lookahead(self):
+        # the states after a token aren't all built
+        return None
+
+    def next(self, state, char):
+        c = self.classes.get(char, None)
+        if c is None:
+            c = self.char_class(char)
+        target = self.trans[state * self.nclasses + c]
+        if target < 0:
+            target = self.expand(state, c)
+        return target
+
+
 def dfa_check(dfa, s):
     cur = dfa
     for c in s:
-        next = cur.arcs.get(c, None)
-        if next is None:
-            if cur.neg_label is not None and c not in cur.neg_label.labels:
-                cur = cur.neg_state
-            else:
-                return None
-        else:
-            cur = next
+        cur = cur.next(c)
+        if cur is None:
+            return None
     if cur.is_final:
         return cur.data(s)
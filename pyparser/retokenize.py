@@ -0,0 +1,340 @@
+import re
+
+from .charset import MAX_CHAR, CharSet, NegLabel
+from .dfa import NFAState, CharClasses, nfa2dfa, compile_dfa
+from .tokenize import Tokenizer, TokenBuilder
+
+
+class TranslateError(Exception):
+    # token patterns the re backend can't run as the DFA does,
+    # `problems` is a list of (token name, reason)
+
+    def __init__(self, problems):
+        Exception.__init__(self, problems)
+        self.problems = problems
+
+    def __str__(self):
+        return '; '.join('%s: %s' % problem for problem in self.problems)
+
+
+def parse_expr(expr):
+    # the token pattern dialect (see TokenBuilder) as a tree of
+    # ('set', CharSet), ('seq', [node]), ('alt', [node]) and
+    # ('rep', node, '?' | '+' | '*')
+    groups = [[[]]]
+    i = 0
+    while i < len(expr):
+        char = expr[i]
+        node = None
+        if char == '(':
+            groups.append([[]])
+        elif char == ')':
+            if len(groups) == 1:
+                raise TranslateError([(expr, 'unmatched ()')])
+            branches = groups.pop()
+            node = ('alt', [('seq', branch) for branch in branches])
+        elif char == '|':
+            if len(groups) == 1:
+                raise TranslateError([(expr, 'invalid `|`,not in ()')])
+            groups[-1].append([])
+        elif char == '[':
+            i, node = parse_class(expr, i + 1)
+        elif char == '\\':
+            i += 1
+            if i == len(expr) or expr[i] not in '\\?+*()[|':
+                raise TranslateError([(expr, 'invalid escape')])
+            groups[-1][-1].append(('set', CharSet(expr[i])))
+        else:
+            groups[-1][-1].append(('set', CharSet(char)))
+        i += 1
+        if node is not None:
+            if i < len(expr) and expr[i] in '?+*':
+                node = ('rep', node, expr[i])
+                i += 1
+            groups[-1][-1].append(node)
+    if len(groups) != 1:
+        raise TranslateError([(expr, 'unmatched ()')])
+    return ('seq', groups[0][0])
+
+
+def parse_class(expr, i):
+    neg = i < len(expr) and expr[i] == '^'
+    if neg:
+        i += 1
+    ranges = []
+    while i < len(expr) and expr[i] != ']':
+        char = expr[i]
+        if char == '-' and ranges and i + 1 < len(expr):
+            ranges[-1] = (ranges[-1][0], expr[i + 1])
+            i += 2
+            continue
+        if char == '\\' and i + 1 < len(expr):
+            i += 1
+            char = expr[i]
+        ranges.append((char, char))
+        i += 1
+    if i == len(expr):
+        raise TranslateError([(expr, 'unmatched []')])
+    if neg:
+        # a plain CharSet: the re class has no shadowing
+        charset = CharSet.from_bounds(NegLabel(ranges=ranges).bounds)
+    else:
+        charset = CharSet(ranges=ranges)
+    return i, ('set', charset)
+
+
+def class_regex(charset):
+    parts = []
+    for lo, hi in charset.intervals():
+        if lo == hi:
+            parts.append(re.escape(lo))
+        else:
+            parts.append('%s-%s' % (re.escape(lo), re.escape(hi)))
+    return ''.join(parts)
+
+
+def node_regex(node):
+    kind = node[0]
+    if kind == 'set':
+        charset = node[1]
+        if len(charset) == 1:
+            return re.escape(list(charset)[0])
+        inverse = charset.complement()
+        if len(inverse.bounds) < len(charset.bounds):
+            return '[^%s]' % class_regex(inverse)
+        return '[%s]' % class_regex(charset)
+    if kind == 'seq':
+        return ''.join(node_regex(item) for item in node[1])
+    if kind == 'alt':
+        return '(?:%s)' % '|'.join(node_regex(item) for item in node[1])
+    return '(?:%s)%s' % (node_regex(node[1]), node[2])
+
+
+def node_nfa(node, cur, arena):
+    # a plain Thompson NFA of `node` from `cur`, returns its end
+    kind = node[0]
+    if kind == 'set':
+        return cur.arc(node[1], NFAState(arena))
+    if kind == 'seq':
+        for item in node[1]:
+            cur = node_nfa(item, cur, arena)
+        return cur
+    if kind == 'alt':
+        end = NFAState(arena)
+        for item in node[1]:
+            node_nfa(item, cur, arena).arc(None, end)
+        return end
+    start = NFAState(arena)
+    cur.arc(None, start)
+    end = node_nfa(node[1], start, arena)
+    out = NFAState(arena)
+    end.arc(None, out)
+    if node[2] in '?*':
+        start.arc(None, out)
+    if node[2] in '+*':
+        end.arc(None, start)
+    return out
+
+
+def first(node):
+    # (nullable, CharSet of the chars a match can start with)
+    kind = node[0]
+    if kind == 'set':
+        return False, node[1]
+    if kind == 'seq':
+        chars = CharSet()
+        for item in node[1]:
+            nullable, item_chars = first(item)
+            chars = chars | item_chars
+            if not nullable:
+                return False, chars
+        return True, chars
+    if kind == 'alt':
+        nullable = False
+        chars = CharSet()
+        for item in node[1]:
+            item_nullable, item_chars = first(item)
+            nullable = nullable or item_nullable
+            chars = chars | item_chars
+        return nullable, chars
+    nullable, chars = first(node[1])
+    return nullable or node[2] != '+', chars
+
+
+def choice_problems(node, follow):
+    # re takes the first option that matches, which is the longest one
+    # only if the next char always tells the options apart
+    kind = node[0]
+    problems = []
+    if kind == 'seq':
+        items = node[1]
+        for k, item in enumerate(items):
+            nullable, rest = first(('seq', items[k + 1:]))
+            problems += choice_problems(item, rest | follow if nullable
+                                        else rest)
+    elif kind == 'alt':
+        seen = CharSet()
+        for item in node[1]:
+            nullable, chars = first(item)
+            if nullable:
+                chars = chars | follow
+            if chars & seen:
+                problems.append('alternatives start alike')
+            seen = seen | chars
+            problems += choice_problems(item, follow)
+    elif kind == 'rep':
+        nullable, chars = first(node[1])
+        if nullable:
+            problems.append('`%s` part matches empty' % node[2])
+        elif chars & follow:
+            problems.append('`%s` part starts like what follows' % node[2])
+        if node[2] != '?':
+            follow = chars | follow
+        problems += choice_problems(node[1], follow)
+    return problems
+
+
+def dfa_table(start, tokens):
+    classes = CharClasses([start])
+    return compile_dfa(nfa2dfa(start, classes=classes), classes, tokens)
+
+
+def find_difference(a, b):
+    # shortest string two DFATables over the same tokens accept as
+    # different tokens (or one doesn't accept), None if they agree
+    chars = [chr(x) for x in sorted(set(a.bounds) | set(b.bounds))
+             if x < MAX_CHAR]
+    seen = {(1, 1): ''}
+    pairs = [(1, 1)]
+    for state_a, state_b in pairs:
+        text = seen[(state_a, state_b)]
+        if a.accept[state_a] != b.accept[state_b]:
+            return text
+        for char in chars:
+            pair = a.next(state_a, char), b.next(state_b, char)
+            if pair != (0, 0) and pair not in seen:
+                seen[pair] = text + char
+                pairs.append(pair)
+    return None
+
+
+class ReTokenizer(Tokenizer):
+    # scans str data with the `re` module: the token patterns become
+    # one named-group alternation, so the per-char loop runs in C. it
+    # refuses (TranslateError) token bases whose patterns re can't run
+    # with the same longest match and token classes as the DFA. only
+    # scan (and so tokens) of str data go through re: streams, bytes-like
+    # buffers, batch and edit still run the DFA, re making one Python
+    # object per match where batch makes none per token
+
+    def __init__(self, token_base, dfa):
+        Tokenizer.__init__(self, token_base, dfa)
+        tokens = list(token_base.__tokens__.values())
+        problems = []
+        roots = []
+        arena = []
+        # by kind, None for keyword tokens (see keyword_tables), which
+        # aren't in the alternation
+        self.patterns = []
+        self.firsts = []
+        for token in tokens:
+            if token.regular_expr is None:
+                self.patterns.append(None)
+                self.firsts.append(None)
+                continue
+            node = parse_expr(token.regular_expr)
+            root = NFAState(arena)
+            end = node_nfa(node, root, arena)
+            end.is_final = True
+            end.data = token
+            roots.append(root)
+            nullable, chars = first(node)
+            if nullable:
+                problems.append((token.__name__, 'accept empty string'))
+                continue
+            for reason in sorted(set(choice_problems(node, CharSet()))):
+                problems.append((token.__name__, reason))
+            builder = dfa_table(TokenBuilder(token).root, [token])
+            text = find_difference(builder, dfa_table(root, [token]))
+            if text is not None:
+                problems.append((token.__name__,
+                                 'the dialect and re differ on %r' % text))
+            self.patterns.append(re.compile(node_regex(node)))
+            self.firsts.append(chars)
+        if not problems:
+            root = NFAState(arena)
+            for token_root in roots:
+                root.arc(None, token_root)
+            try:
+                table = dfa_table(root, tokens)
+            except Exception:
+                # from nfa2dfa: two tokens accept the same string
+                problems.append(('*', 'tokens accept the same string '
+                                      'under re'))
+            else:
+                text = find_difference(token_base.compile_dfa(), table)
+                if text is not None:
+                    problems.append(('*', 'the tokens together take %r '
+                                          'otherwise under re' % text))
+        if problems:
+            raise TranslateError(problems)
+        self.master = re.compile('|'.join(
+            '(?P<%s>%s)' % (token.__name__, pattern.pattern)
+            for token, pattern in zip(tokens, self.patterns)
+            if pattern is not None))
+        self.kinds = dict((token.__name__, kind)
+                          for kind, token in enumerate(tokens))
+        # chars more than one token can start with, the alternation takes
+        # the first of them, not the longest
+        self.shared = CharSet()
+        firsts = [chars for chars in self.firsts if chars is not None]
+        for k, chars in enumerate(firsts):
+            for other in firsts[k + 1:]:
+                self.shared = self.shared | (chars & other)
+        self.candidates = {}
+
+    def scan(self, data, i=0, end=None, resume=None, window=16384):
+        if resume is not None or not isinstance(data, str):
+            return Tokenizer.scan(self, data, i, end, resume, window)
+        return self.re_scan(data, i, len(data) if end is None else end)
+
+    def re_scan(self, data, i, end):
+        match = self.master.match
+        kinds = self.kinds
+        ignore = self.dfa.ignore
+        keywords = self.dfa.keywords
+        shared = self.shared if self.shared else None
+        while i < end:
+            if shared is not None and data[i] in shared:
+                kind, stop = self.longest(data, i, end)
+            else:
+                m = match(data, i, end)
+                if m is None:
+                    kind = -1
+                else:
+                    kind = kinds[m.lastgroup]
+                    stop = m.end()
+            if kind < 0:
+                # no token starts here, the DFA tells where it fails
+                for token in Tokenizer.scan(self, data, i, end):
+                    pass
+                raise Exception('re and DFA disagree at %d' % i)
+            if not ignore[kind]:
+                if kind in keywords:
+                    kind = self.keyword(kind, data, i, stop)
+                yield kind, i, stop
+            i = stop
+
+    def longest(self, data, i, end):
+        char = data[i]
+        candidates = self.candidates.get(char, None)
+        if candidates is None:
+            candidates = self.candidates[char] = [
+                kind for kind, chars in enumerate(self.firsts)
+                if chars is not None and char in chars]
+        best = (-1, i)
+        for kind in candidates:
+            m = self.patterns[kind].match(data, i, end)
+            if m is not None and m.end() > best[1]:
+                best = (kind, m.end())
+        return best
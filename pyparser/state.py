@@ -1,9 +1,19 @@
-
-
 class State(object):
+    # a numbered rule DFA state, `rule` the Symbol of the rule it's in.
+    # arcs are (type, next state, value): a token arc has the token's
+    # Symbol as type, a literal arc None and the literal as value, a rule
+    # arc the rule's Symbol
+    __slots__ = ['num', 'rule', 'final', 'arcs']
 
-    def __init__(self):
-        pass
+    def __init__(self, num, rule=None, final=False):
+        self.num = num
+        self.rule = rule
+        self.final = final
+        self.arcs = []
 
     def arc(self, type, state, value=None):
-        pass
+        self.arcs.append((type, state, value))
+        return state
+
+    def __repr__(self):
+        return 'State(%d)' % self.num
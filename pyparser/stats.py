@@ -0,0 +1,59 @@
+import time
+
+
+class Stats(object):
+    # counters filled by an instrumented build or scan. `callback`, if
+    # any, gets the stats once they are complete, to export them
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.times = {}
+
+    def lap(self, phase, start):
+        # adds the seconds since `start` (a perf_counter value) to the
+        # phase's time, returns the current perf_counter
+        now = time.perf_counter()
+        self.times[phase] = self.times.get(phase, 0) + now - start
+        return now
+
+    def report(self):
+        if self.callback is not None:
+            self.callback(self)
+
+    def as_dict(self):
+        return dict((name, value) for name, value in vars(self).items()
+                    if name != 'callback')
+
+
+class BuildStats(Stats):
+    # a token base's DFA build: NFA states, DFA states from the subset
+    # construction and left by minimizing, hits and misses of nfa2dfa's
+    # caches (NFASets closures by NFA state, DFA states by NFA state
+    # set), and seconds per phase
+
+    def __init__(self, callback=None):
+        Stats.__init__(self, callback)
+        self.nfa_states = 0
+        self.dfa_states = 0
+        self.min_states = 0
+        self.closure_hits = 0
+        self.closure_misses = 0
+        self.subset_hits = 0
+        self.cached = False
+
+
+class ScanStats(Stats):
+    # a scan: count and chars of every token class (ignored ones too),
+    # visits of each DFA state by the tokens matched, chars whose class
+    # wasn't cached and had to be bisected out of the class bounds, and
+    # backtracks to an earlier accept
+
+    def __init__(self, callback=None):
+        Stats.__init__(self, callback)
+        self.chars = 0
+        self.tokens = 0
+        self.counts = {}
+        self.sizes = {}
+        self.state_visits = []
+        self.class_misses = 0
+        self.backtracks = 0
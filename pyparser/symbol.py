@@ -1,5 +1,45 @@
-
 class Symbol(object):
+    # a numbered grammar symbol, `cls` is its token class or rule class
+    __slots__ = ['num', 'name', 'cls']
+
+    def __init__(self, num, name, cls=None):
+        self.num = num
+        self.name = name
+        self.cls = cls
+
+    def __repr__(self):
+        return 'Symbol(%d, %r)' % (self.num, self.name)
+
+
+class SymbolTable(object):
+    # the token classes numbered first, in the order given (a DFA's
+    # tokens, so a TokenBatch kind is its token's symbol number), then
+    # the rules
+
+    def __init__(self, tokens, rules):
+        self.symbols = []
+        self.numbers = {}
+        for token in tokens:
+            self.add(token.__name__, token)
+        self.ntokens = len(self.symbols)
+        for rule in rules:
+            self.add(rule.__name__, rule)
+
+    def add(self, name, cls=None):
+        symbol = Symbol(len(self.symbols), name, cls)
+        self.symbols.append(symbol)
+        if cls is not None:
+            self.numbers[cls] = symbol.num
+        return symbol
+
+    def __getitem__(self, num):
+        return self.symbols[num]
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def number(self, cls):
+        return self.numbers[cls]
 
-    def __init__(self, num, name):
-        pass
+    def is_token(self, num):
+        return num < self.ntokens
@@ -1,17 +1,31 @@
-from .dfa import nfa2dfa, NegLabel, NFAState
+import codecs
+import os
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+
+from . import cache
+from .charset import CharSet, NegLabel
+from .stats import ScanStats
+from .dfa import (nfa2dfa, compile_dfa, CharClasses, DFATable, LazyDFATable,
+                  NFAState)
 
 
 class TokenBuilder(object):
+    # the NFA of a token, its states are added to `arena` (see NFAState)
 
-    def __init__(self, cls):
+    def __init__(self, cls, arena=None):
         self.token = cls
         self.reg_expr = cls.regular_expr
+        self.arena = [] if arena is None else arena
         self.make_states()
 
     def make_states(self):
         # FIXME code tidy
         par_stack = []  # for ()
-        root = NFAState()
+        root = NFAState(self.arena)
         cur = root
         i = 0
         while i < len(self.reg_expr):
@@ -38,7 +52,7 @@ class TokenBuilder(object):
                     raise Exception('invalid `|`,not in ()')
                 start = par_stack[-1]
                 if start[1] is None:
-                    start[1] = NFAState()
+                    start[1] = NFAState(self.arena)
                 cur.arc(None, start[1])
                 cur = start[0]
             elif char == '[':
@@ -50,22 +64,20 @@ class TokenBuilder(object):
                         neg = True
                         i += 1
                 pair_made = False
-                chars = []
+                ranges = []
                 while i < len(self.reg_expr):
                     char = self.reg_expr[i]
                     if char == ']':
                         pair_made = True
                         break
                     elif char == '-':
-                        if i + 1 == len(self.reg_expr) or len(chars) == 0:
+                        if i + 1 == len(self.reg_expr) or len(ranges) == 0:
                             raise Exception('invalid range -')
                         end_char = self.reg_expr[i + 1]
-                        start_char = chars[-1]
-                        if start_char >= end_char:
+                        start_char, last_char = ranges[-1]
+                        if last_char >= end_char:
                             raise Exception('invalid range')
-                        chars.extend(
-                            [chr(x) for x in range(
-                                ord(start_char) + 1, ord(end_char) + 1)])
+                        ranges[-1] = (start_char, end_char)
                         i += 2
                         continue
                     elif char == '\\':
@@ -77,16 +89,15 @@ class TokenBuilder(object):
                         else:
                             raise Exception('invalid escape')
                         i += 1
-                    chars.append(char)
+                    ranges.append((char, char))
                     i += 1
                 if not pair_made:
                     raise Exception('unmatched []')
-                end = NFAState()
+                end = NFAState(self.arena)
                 if neg:
-                    cur.arc(NegLabel(chars), end)
+                    cur.arc(NegLabel(ranges=ranges), end)
                 else:
-                    for char in chars:
-                        cur.arc(char, end)
+                    cur.arc(CharSet(ranges=ranges), end)
                 i += 1
                 if i < len(self.reg_expr):
                     next_char = self.reg_expr[i]
@@ -106,11 +117,11 @@ class TokenBuilder(object):
                     raise Exception('invalid escape(at end)')
                 next_char = self.reg_expr[i]
                 if next_char in '\\?+*()[|':
-                    cur = cur.arc(next_char, NFAState())
+                    cur = cur.arc(CharSet(next_char), NFAState(self.arena))
                 else:
                     raise Exception('invalid escape')
             else:
-                cur = cur.arc(char, NFAState())
+                cur = cur.arc(CharSet(char), NFAState(self.arena))
             i += 1
         if len(par_stack) != 0:
             raise Exception('unmatched ()')
@@ -133,73 +144,1182 @@ class TokenBuilder(object):
         end.arc(None, start)
 
 
+def iter_chunks(source, chunk_size=65536, encoding='utf-8'):
+    # str chunks out of a str, a bytes-like object, anything with a
+    # `read` (file objects, mmap) or an iterable of str/bytes chunks.
+    # bytes are decoded incrementally, a char may straddle two chunks
+    if isinstance(source, str):
+        chunks = [source]
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        chunks = (view[i:i + chunk_size].tobytes()
+                  for i in range(0, len(view), chunk_size))
+    elif hasattr(source, 'read'):
+        chunks = iter(lambda: source.read(chunk_size), source.read(0))
+    else:
+        chunks = source
+    decoder = None
+    for chunk in chunks:
+        if not isinstance(chunk, str):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder(encoding)()
+            chunk = decoder.decode(chunk)
+        if chunk:
+            yield chunk
+    if decoder is not None:
+        chunk = decoder.decode(b'', True)
+        if chunk:
+            yield chunk
+
+
+class ScanState(object):
+    # where an unfinished scan stopped: the DFA state and the start of
+    # the token still running, relative to the data scanned. the other
+    # slots belong to the backtracking path, see Tokenizer.munch
+    __slots__ = ['state', 'start', 'last_kind', 'last_end', 'trail',
+                 'failed', 'fail_end', 'flushes']
+
+    def __init__(self, state=1, start=0):
+        self.state = state
+        self.start = start
+        self.last_kind = -1
+        self.last_end = start
+        self.trail = None
+        self.failed = {}
+        self.fail_end = -1
+        # the DFA's flushes when `failed` and `trail` were filled
+        self.flushes = 0
+
+    def rebase(self, shift):
+        # for data cut `shift` chars further on
+        self.start -= shift
+        self.last_end -= shift
+        self.fail_end -= shift
+        if self.trail is not None:
+            self.trail = [(state, i - shift) for state, i in self.trail]
+        self.failed = dict(((state, i - shift), dead - shift)
+                           for (state, i), dead in self.failed.items()
+                           if i >= shift)
+
+
+class LineIndex(object):
+    # line starts of `data`, found lazily and only as far as the furthest
+    # offset asked for. `offset`, `lineno` and `index` place data[0] in a
+    # larger input, for the chunks of a stream. `edits` lists the (cut,
+    # shift) of each edit() so far: the tokens placed before one move
+    # `shift` chars if they start at `cut` or after
+    __slots__ = ['data', 'newline', 'starts', 'scanned', 'offset',
+                 'lineno', 'index', 'edits']
+
+    def __init__(self, data, offset=0, lineno=1, index=0):
+        self.data = data
+        self.newline = '\n' if isinstance(data, str) else b'\n'
+        self.starts = [0]
+        self.scanned = 0
+        self.offset = offset
+        self.lineno = lineno
+        self.index = index
+        self.edits = []
+
+    def edit(self, data, offset, deleted, shift):
+        # `data` is the old one with the `deleted` chars at `offset`
+        # replaced, `shift` chars longer. the line starts up to offset
+        # are kept
+        self.data = data
+        del self.starts[bisect_right(self.starts, offset):]
+        self.scanned = min(self.scanned, offset)
+        self.edits.append((offset + deleted, shift))
+
+    def scan(self, end):
+        # record the newlines of data[scanned:end], a block at a time so
+        # close offsets don't each cost a call
+        end = min(max(end, self.scanned + 65536), len(self.data))
+        data = self.data
+        base = 0
+        if isinstance(data, memoryview):
+            # memoryview can't find
+            data = data[self.scanned:end].tobytes()
+            base = self.scanned
+        add_start = self.starts.append
+        newline = self.newline
+        i = data.find(newline, self.scanned - base, end - base)
+        while i >= 0:
+            add_start(base + i + 1)
+            i = data.find(newline, i + 1, end - base)
+        self.scanned = end
+
+    def position(self, offset):
+        # (lineno, index) of an offset of the input
+        offset -= self.offset
+        if offset > self.scanned:
+            self.scan(offset)
+        line = bisect_right(self.starts, offset) - 1
+        index = offset - self.starts[line]
+        if line == 0:
+            index += self.index
+        return self.lineno + line, index
+
+
 class Tokenizer(object):
 
-    def __init__(self, token_base, root):
+    def __init__(self, token_base, dfa):
         self.token_base = token_base
-        self.root = root
+        self.dfa = dfa
+        # dfa.lookahead(), -1 until edit() needs it
+        self.reads = -1
 
     def get_token_cls(self, name):
-        return self.token_base.__token_states__.get(name, None)
+        return self.token_base.__tokens__.get(name, None)
 
-    def tokens(self, data):
-        cur = self.root
-        start_i = 0
-        i = 0
-        lineno = 1
-        line_index = 0
-        while i < len(data):
-            char = data[i]
-            next = cur.next(char)
-            if next is None:
-                if cur.is_final:
-                    if not cur.data.ignore:
-                        yield cur.data(data[start_i:i])
-                    start_i = i
-                    cur = self.root
+    def keyword(self, kind, data, start, end):
+        # the kind of data[start:end], a token of `kind` with keywords
+        exact, folded = self.dfa.keywords[kind]
+        text = data[start:end]
+        if not isinstance(text, str):
+            text = bytes(text).decode('latin-1')
+        found = exact.get(text, None)
+        if found is None and folded:
+            found = folded.get(text.lower(), None)
+        return kind if found is None else found
+
+    def unexpected_char(self, data, i, lines=None):
+        char = data[i]
+        if isinstance(char, int):
+            char = chr(char)
+        if lines is None:
+            lines = LineIndex(data)
+        return self.token_base.UnexpectedCharError(lines, i, char)
+
+    def scan_into(self, data, i, end, resume, kinds, starts, ends):
+        # the scanning loop: appends kind, start and end of the non-ignored
+        # tokens of data[i:end] to the three sequences, longest match
+        # first. it carries on with the token `resume` (a ScanState)
+        # describes and stores where it stopped back into it, the token
+        # running into `end` is left to the next call or to `finish`
+        if resume.trail is not None:
+            i = self.munch(data, i, end, resume, kinds, starts, ends)
+        dfa = self.dfa
+        classes = dfa.classes
+        nclasses = dfa.nclasses
+        trans = dfa.trans
+        accept = dfa.accept
+        ignore = dfa.ignore
+        keywords = dfa.keywords
+        add_kind = kinds.append
+        add_start = starts.append
+        add_end = ends.append
+        state = resume.state
+        start_i = resume.start
+        while i < end:
+            c = classes.get(data[i], None)
+            if c is None:
+                c = dfa.char_class(data[i])
+            next = trans[state * nclasses + c]
+            if next > 0:
+                state = next
+                i += 1
+                continue
+            if next < 0:
+                # not built yet, only a LazyDFATable has these
+                next = dfa.expand(state, c)
+                if next:
+                    state = next
+                    i += 1
+                    continue
+            kind = accept[state]
+            if kind < 0:
+                # died past the last accept, if any: go back to it
+                resume.state = 1
+                resume.start = resume.last_end = start_i
+                resume.last_kind = -1
+                resume.trail = []
+                resume.fail_end = i
+                i = self.munch(data, start_i, end, resume,
+                               kinds, starts, ends)
+                state = resume.state
+                start_i = resume.start
+                continue
+            if not ignore[kind]:
+                if kind in keywords:
+                    kind = self.keyword(kind, data, start_i, i)
+                add_kind(kind)
+                add_start(start_i)
+                add_end(i)
+            start_i = i
+            state = 1
+        resume.state = state
+        resume.start = start_i
+
+    def munch(self, data, i, end, resume, kinds, starts, ends, final=False):
+        # slow path of scan_into, taken when the DFA dies in a state that
+        # doesn't accept. it walks the token again from its start keeping
+        # the last accepting offset, emits the longest match and goes on
+        # from its end. the (state, offset) pairs seen on the way to a
+        # dead end are memoized in `resume.failed` with where they die,
+        # so no offset is walked twice in the same state and the whole
+        # scan stays linear. it gives back to the fast loop between two
+        # tokens past every memoized offset, or at `end`; with `final`
+        # the input ends there. a LazyDFATable flush renumbers the states,
+        # the memo and the trail are dropped then
+        dfa = self.dfa
+        classes = dfa.classes
+        nclasses = dfa.nclasses
+        trans = dfa.trans
+        accept = dfa.accept
+        ignore = dfa.ignore
+        failed = resume.failed
+        if resume.flushes != dfa.flushes:
+            resume.flushes = dfa.flushes
+            failed.clear()
+            if resume.trail is not None:
+                del resume.trail[:]
+        state = resume.state
+        start_i = resume.start
+        last_kind = resume.last_kind
+        last_end = resume.last_end
+        trail = resume.trail
+        while True:
+            # at the start of a token: the DFA may come back to state 1
+            # within one
+            if i == start_i:
+                if i > resume.fail_end:
+                    failed.clear()
+                    trail = None
+                    break
+                if i >= end:
+                    break
+            dead = failed.get((state, i), None)
+            if dead is None:
+                if i >= end:
+                    if not final:
+                        break
+                    dead = end
                 else:
-                    raise self.token_base.UnexpectedCharError(
-                        lineno, line_index, char)
+                    c = classes.get(data[i], None)
+                    if c is None:
+                        c = dfa.char_class(data[i])
+                    next = trans[state * nclasses + c]
+                    if next < 0:
+                        next = dfa.expand(state, c)
+                        if resume.flushes != dfa.flushes:
+                            resume.flushes = dfa.flushes
+                            failed.clear()
+                            del trail[:]
+                    if next:
+                        state = next
+                        i += 1
+                        if accept[state] >= 0:
+                            last_kind = accept[state]
+                            last_end = i
+                            del trail[:]
+                        else:
+                            trail.append((state, i))
+                        continue
+                    dead = i
+            if last_kind < 0:
+                resume.state = state
+                resume.start = start_i
+                if dead >= end and final:
+                    raise self.token_base.UnexpectedEOFError()
+                raise self.unexpected_char(data, dead)
+            for pair in trail:
+                failed[pair] = dead
+            if dead > resume.fail_end:
+                resume.fail_end = dead
+            del trail[:]
+            if not ignore[last_kind]:
+                if last_kind in dfa.keywords:
+                    last_kind = self.keyword(last_kind, data, start_i,
+                                             last_end)
+                kinds.append(last_kind)
+                starts.append(start_i)
+                ends.append(last_end)
+            i = start_i = last_end
+            state = 1
+            last_kind = -1
+        resume.state = state
+        resume.start = start_i
+        resume.last_kind = last_kind
+        resume.last_end = last_end
+        resume.trail = trail
+        return i
+
+    def finish(self, data, resume, end, kinds, starts, ends):
+        # the tokens left by a scan of data[:end] stopped in `resume`
+        kind = self.dfa.accept[resume.state]
+        if resume.trail is None and kind >= 0:
+            if not self.dfa.ignore[kind]:
+                if kind in self.dfa.keywords:
+                    kind = self.keyword(kind, data, resume.start, end)
+                kinds.append(kind)
+                starts.append(resume.start)
+                ends.append(end)
+            return
+        if resume.start >= end:
+            return
+        if resume.trail is None:
+            resume.last_end = resume.start
+            resume.last_kind = -1
+            resume.trail = []
+            resume.state = 1
+            i = resume.start
+        else:
+            i = end
+        resume.fail_end = max(resume.fail_end, end)
+        self.munch(data, i, end, resume, kinds, starts, ends, final=True)
+
+    def scan(self, data, i=0, end=None, resume=None, window=16384):
+        # yields (kind, start, end) of the non-ignored tokens of
+        # data[i:end], `window` chars at a time. given a ScanState the
+        # scan carries on from it and stores where it stopped into it
+        # instead of finishing the last token. on a lexing error every
+        # token before it is yielded first
+        if end is None:
+            end = len(data)
+        cursor = ScanState(1, i) if resume is None else resume
+        kinds = []
+        starts = []
+        ends = []
+        try:
+            while i < end:
+                stop = min(i + window, end)
+                self.scan_into(data, i, stop, cursor, kinds, starts, ends)
+                for token in zip(kinds, starts, ends):
+                    yield token
+                del kinds[:], starts[:], ends[:]
+                i = stop
+            if resume is None:
+                self.finish(data, cursor, end, kinds, starts, ends)
+        except (self.token_base.UnexpectedCharError,
+                self.token_base.UnexpectedEOFError):
+            for token in zip(kinds, starts, ends):
+                yield token
+            raise
+        for token in zip(kinds, starts, ends):
+            yield token
+
+    def tokens(self, data):
+        token_classes = self.dfa.tokens
+        lines = LineIndex(data)
+        for kind, start, end in self.scan(data):
+            token = token_classes[kind](data[start:end])
+            token.place(start, end, lines)
+            yield token
+
+    def span_tokens(self, data, encoding=None):
+        # tokens of a str or of a bytes-like buffer (bytes, bytearray,
+        # memoryview, mmap; scanned as latin-1) that only keep their
+        # offsets, `data` is sliced out of the buffer on first access
+        span_classes = [token.span_class() for token in self.dfa.tokens]
+        lines = LineIndex(data)
+        for kind, start, end in self.scan(data):
+            yield span_classes[kind](data, start, end, encoding, lines)
+
+    def batch(self, data, linenos=False, encoding=None):
+        # all the tokens of a str or bytes-like buffer as a TokenBatch,
+        # in one pass and without a Python object per token
+        offset = 'I' if len(data) < 1 << 32 else 'Q'
+        kinds = array('H')
+        starts = array(offset)
+        ends = array(offset)
+        resume = ScanState()
+        self.scan_into(data, 0, len(data), resume, kinds, starts, ends)
+        self.finish(data, resume, len(data), kinds, starts, ends)
+        batch = TokenBatch(self.dfa.tokens, data, kinds, starts, ends,
+                           encoding=encoding)
+        if linenos:
+            batch.linenos = count_lines(data, starts)
+        return batch
+
+    def parallel_batch(self, data, workers=None, chunk_size=None,
+                       linenos=False, encoding=None):
+        # same as batch, with the chunks of `data` tokenized in `workers`
+        # processes. each worker guesses that a token starts at its
+        # chunk's first char. the chunks are then stitched in order: the
+        # scan goes on from where the previous chunk really stopped until
+        # it starts a token where the guess started one too, from there
+        # on the guess is what a sequential scan finds
+        if isinstance(self.dfa, LazyDFATable):
+            raise Exception('parallel tokenizing needs a compiled DFA')
+        workers = workers or os.cpu_count() or 1
+        if chunk_size is None:
+            chunk_size = len(data) // workers + 1
+        if len(data) <= chunk_size:
+            return self.batch(data, linenos, encoding)
+        offset = 'I' if len(data) < 1 << 32 else 'Q'
+        tables = self.dfa.__getstate__()
+        tables['tokens'] = None
+        bounds = list(range(0, len(data), chunk_size)) + [len(data)]
+        chunks = list(zip(bounds, bounds[1:]))
+        kinds = array('H')
+        starts = array(offset)
+        ends = array(offset)
+        resume = ScanState()
+        with ProcessPoolExecutor(workers, initializer=init_worker,
+                                 initargs=(tables,)) as pool:
+            guesses = []
+            for start, end in chunks:
+                chunk = data[start:end]
+                if isinstance(chunk, memoryview):
+                    chunk = chunk.tobytes()
+                guesses.append(pool.submit(scan_chunk, chunk, start, offset))
+            for (start, end), guess in zip(chunks, guesses):
+                resume = self.stitch(data, start, end, resume, guess.result(),
+                                     kinds, starts, ends)
+        self.finish(data, resume, len(data), kinds, starts, ends)
+        batch = TokenBatch(self.dfa.tokens, data, kinds, starts, ends,
+                           encoding=encoding)
+        if linenos:
+            batch.linenos = count_lines(data, starts)
+        return batch
+
+    def stitch(self, data, start, end, resume, guess, kinds, starts, ends):
+        # scan data[start:end] on from `resume`, a growing window at a
+        # time, until the scan starts a token the guess (a scan_chunk
+        # result) starts too, then take the rest of the guess. returns
+        # where the chunk's scan stopped
+        guess_kinds, guess_starts, guess_ends, guess_resume, error = guess
+        i = start
+        window = 256
+        while i < end:
+            stop = min(i + window, end)
+            mark = len(kinds)
+            self.scan_into(data, i, stop, resume, kinds, starts, ends)
+            for x in range(mark, len(kinds)):
+                k = bisect_left(guess_starts, starts[x])
+                if k < len(guess_starts) and guess_starts[k] == starts[x]:
+                    del kinds[x:], starts[x:], ends[x:]
+                    kinds.extend(guess_kinds[k:])
+                    starts.extend(guess_starts[k:])
+                    ends.extend(guess_ends[k:])
+                    if error >= 0:
+                        raise self.unexpected_char(data, error)
+                    return guess_resume
+            i = stop
+            window *= 2
+        return resume
+
+    def edit(self, batch, offset, deleted, inserted):
+        # the TokenBatch of batch.data with the `deleted` chars at `offset`
+        # replaced by `inserted`, and (first, old_stop, new_stop): tokens
+        # [first, old_stop) of `batch` became [first, new_stop). the scan
+        # starts at the end of the last token the edit can't change (it
+        # ends far enough before it, see DFATable.lookahead) and stops as
+        # soon as it starts a token past the edit where the old scan
+        # started one, the rest are the old tokens moved: their offsets
+        # and line numbers are left short (see TokenBatch), only those
+        # between the edit and the previous one are rewritten. the tokens
+        # made from `batch` follow the edit, see TokenBaseMixin
+        data = batch.data
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        new = data[:offset] + inserted + data[offset + deleted:]
+        shift = len(inserted) - deleted
+        if self.reads == -1:
+            self.reads = self.dfa.lookahead()
+        if self.reads is None:
+            first = 0
+        else:
+            first = batch.find_end(offset - self.reads)
+        i = batch.span(first - 1)[1] if first else 0
+        offsets = batch.raw_starts.typecode
+        if offsets == 'I' and len(new) >= 1 << 32:
+            offsets = 'Q'
+        kinds = array('H')
+        starts = array(offsets)
+        ends = array(offsets)
+        resume = ScanState(1, i)
+        old_stop = None
+        window = 256
+        while i < len(new) and old_stop is None:
+            stop = min(i + window, len(new))
+            mark = len(kinds)
+            self.scan_into(new, i, stop, resume, kinds, starts, ends)
+            for x in range(mark, len(kinds)):
+                if starts[x] < offset + len(inserted):
+                    continue
+                k = batch.find_start(starts[x] - shift)
+                if k is not None:
+                    del kinds[x:], starts[x:], ends[x:]
+                    old_stop = k
+                    break
+            i = stop
+            window *= 2
+        if old_stop is None:
+            self.finish(new, resume, len(new), kinds, starts, ends)
+            old_stop = len(batch)
+        new_stop = first + len(kinds)
+        gap = batch.gap
+        edited = TokenBatch(
+            batch.tokens, new, splice(batch.kinds, first, kinds, old_stop),
+            splice(batch.raw_starts, first, starts, old_stop, gap,
+                   batch.shift),
+            splice(batch.raw_ends, first, ends, old_stop, gap, batch.shift),
+            encoding=batch.encoding)
+        edited.gap = new_stop
+        edited.shift = batch.shift + shift
+        if batch.raw_linenos is not None:
+            newline = '\n' if isinstance(new, str) else b'\n'
+            if first:
+                start, end = batch.span(first - 1)
+                lineno = batch.lineno(first - 1) + new.count(
+                    newline, start, end)
             else:
-                cur = next
-                i += 1
-                line_index += 1
-                if char == '\n':
-                    lineno += 1
-                    line_index = 0
-        if cur.is_final:
-            if not cur.data.ignore:
-                yield cur.data(data[start_i:])
+                end = 0
+                lineno = 1
+            lines = array(batch.raw_linenos.typecode,
+                          count_lines(new, starts, end, lineno))
+            edited.raw_linenos = splice(batch.raw_linenos, first, lines,
+                                        old_stop, gap, batch.line_shift)
+            edited.line_shift = batch.line_shift + (
+                inserted.count(newline) -
+                data[offset:offset + deleted].count(newline))
+        # the tokens made from `batch` follow the edit through its
+        # LineIndex, `batch` gets one of its own
+        edited.lines = batch.lines
+        batch.lines = LineIndex(batch.data)
+        edited.lines.edit(new, offset, deleted, shift)
+        return edited, (first, old_stop, new_stop)
+
+    def profile(self, data, stats=None):
+        # scans data as batch() does, into a ScanStats (a new one if None)
+        # which is reported and returned. the counting is done by walking
+        # the tokens found again, the scanning loop itself has no hooks
+        if isinstance(self.dfa, LazyDFATable):
+            raise Exception('profiling needs a compiled DFA')
+        if stats is None:
+            stats = ScanStats()
+        dfa = self.dfa
+        # ignored tokens are counted too
+        table = DFATable(dfa.bounds, dfa.bound_classes, dfa.nclasses,
+                         dfa.trans, dfa.accept, dfa.tokens,
+                         bytearray(len(dfa.ignore)))
+        cached = len(table.classes)
+        start = time.perf_counter()
+        found = Tokenizer(self.token_base, table).batch(data)
+        stats.lap('scan', start)
+        stats.chars += len(data)
+        stats.tokens += sum(1 for kind in found.kinds if not dfa.ignore[kind])
+        stats.class_misses += len(table.classes) - cached
+        visits = [0] * dfa.nstates
+        for kind, token_start, token_end in zip(found.kinds, found.starts,
+                                                found.ends):
+            name = dfa.tokens[kind].__name__
+            stats.counts[name] = stats.counts.get(name, 0) + 1
+            stats.sizes[name] = (stats.sizes.get(name, 0) + token_end -
+                                 token_start)
+            state = 1
+            visits[1] += 1
+            for i in range(token_start, token_end):
+                state = table.next(state, data[i])
+                visits[state] += 1
+            # the scan went on past the token and came back
+            if (token_end < len(data) and
+                    table.next(state, data[token_end]) > 0):
+                stats.backtracks += 1
+        if len(stats.state_visits) < len(visits):
+            stats.state_visits.extend(
+                [0] * (len(visits) - len(stats.state_visits)))
+        for state, count in enumerate(visits):
+            stats.state_visits[state] += count
+        stats.report()
+        return stats
+
+    def tokenize_many(self, docs, workers=None, chunk_size=64, ordered=True,
+                      encoding=None):
+        # tokenizes many small documents in `workers` processes, which get
+        # the DFA tables once, `chunk_size` documents per task. yields
+        # (index, result) in document order or, unless `ordered`, as the
+        # chunks complete. result is the document's TokenBatch or the
+        # exception tokenizing it raised
+        if isinstance(self.dfa, LazyDFATable):
+            raise Exception('parallel tokenizing needs a compiled DFA')
+        tables = self.dfa.__getstate__()
+        tables['tokens'] = None
+        for i, doc, found in map_chunks(init_worker, (tables,), scan_docs,
+                                        docs, workers, chunk_size, ordered):
+            if isinstance(found, Exception):
+                yield i, found
+                continue
+            kinds, starts, ends, error = found
+            if error < 0:
+                yield i, TokenBatch(self.dfa.tokens, doc, kinds, starts,
+                                    ends, encoding=encoding)
+            elif error == len(doc):
+                yield i, self.token_base.UnexpectedEOFError()
+            else:
+                yield i, self.unexpected_char(doc, error)
+
+    def stream(self, source, chunk_size=65536, encoding='utf-8'):
+        # same tokens as `tokens`, but `source` is read chunk by chunk
+        # (see iter_chunks), so memory is bounded by the chunk size plus
+        # the longest token
+        stream = TokenStream(self)
+        for chunk in iter_chunks(source, chunk_size, encoding):
+            for token in stream.feed(chunk):
+                yield token
+        for token in stream.close():
+            yield token
+
+
+class ChunkErrors(object):
+    # token base of the worker processes of parallel_batch and
+    # tokenize_many, which only get the DFA tables: token classes may not
+    # be picklable
+    class UnexpectedCharError(Exception):
+        pass
+
+    class UnexpectedEOFError(Exception):
+        pass
+
+
+worker_tokenizer = None
+
+
+def init_worker(tables):
+    global worker_tokenizer
+    dfa = DFATable.__new__(DFATable)
+    dfa.__setstate__(tables)
+    worker_tokenizer = Tokenizer(ChunkErrors, dfa)
+
+
+def scan_chunk(chunk, start, offset):
+    # the guess for a chunk at `start`: its tokens if one starts at its
+    # first char, the ScanState at its end and the offset of the first
+    # char no token takes (or -1), all offsets in the whole input
+    kinds = array('H')
+    starts = array(offset)
+    ends = array(offset)
+    resume = ScanState()
+    error = -1
+    try:
+        worker_tokenizer.scan_into(chunk, 0, len(chunk), resume,
+                                   kinds, starts, ends)
+    except ChunkErrors.UnexpectedCharError as e:
+        error = e.args[1] + start
+    resume.rebase(-start)
+    starts = array(offset, [x + start for x in starts])
+    ends = array(offset, [x + start for x in ends])
+    return kinds, starts, ends, resume, error
+
+
+def scan_docs(docs):
+    # kinds, starts, ends and the offset of the first char no token takes
+    # of each document: -1 if none, the document's length for an
+    # unexpected end
+    results = []
+    for doc in docs:
+        kinds = array('H')
+        starts = array('I')
+        ends = array('I')
+        resume = ScanState()
+        error = -1
+        try:
+            worker_tokenizer.scan_into(doc, 0, len(doc), resume,
+                                       kinds, starts, ends)
+            worker_tokenizer.finish(doc, resume, len(doc),
+                                    kinds, starts, ends)
+        except ChunkErrors.UnexpectedCharError as e:
+            error = e.args[1]
+        except ChunkErrors.UnexpectedEOFError:
+            error = len(doc)
+        results.append((kinds, starts, ends, error))
+    return results
+
+
+def map_chunks(initializer, initargs, task, docs, workers=None,
+               chunk_size=64, ordered=True):
+    # runs task(chunk) in a process pool for chunks of `chunk_size` docs,
+    # task returns one result per doc. yields (index, doc, result), in
+    # order or as the chunks complete, with at most two chunks per
+    # worker read from `docs` ahead. a chunk whose task fails, or whose
+    # results don't pickle, has the exception as the result of each doc
+    workers = workers or os.cpu_count() or 1
+    docs = iter(docs)
+    running = []
+    index = 0
+    with ProcessPoolExecutor(workers, initializer=initializer,
+                             initargs=initargs) as pool:
+        while True:
+            while len(running) < 2 * workers:
+                chunk = list(islice(docs, chunk_size))
+                if not chunk:
+                    break
+                running.append((index, chunk, pool.submit(task, chunk)))
+                index += len(chunk)
+            if not running:
+                break
+            if ordered:
+                done = running[0]
+            else:
+                wait([future for _, _, future in running],
+                     return_when=FIRST_COMPLETED)
+                done = [run for run in running if run[2].done()][0]
+            running.remove(done)
+            first, chunk, future = done
+            try:
+                results = future.result()
+            except Exception as e:
+                results = [e] * len(chunk)
+            for i, (doc, result) in enumerate(zip(chunk, results)):
+                yield first + i, doc, result
+
+
+def count_lines(data, offsets, last=0, lineno=1):
+    # line number of each of the sorted `offsets`, `lineno` being the line
+    # of offset `last`
+    if not isinstance(data, (str, bytes, bytearray)):
+        data = bytes(data)
+    newline = '\n' if isinstance(data, str) else b'\n'
+    lines = array('I')
+    for offset in offsets:
+        lineno += data.count(newline, last, offset)
+        last = offset
+        lines.append(lineno)
+    return lines
+
+
+def splice(old, first, middle, stop, gap=None, shift=0):
+    # old[:first] + middle + old[stop:] as an array of middle's type. with
+    # `gap` the entries of old from `gap` on are `shift` short (see
+    # TokenBatch), so are those of the result from old[stop:] on. if that
+    # makes one negative the array is of signed 'q' instead
+    typecode = middle.typecode
+    tail = old[stop:]
+    moved = None
+    if shift and gap > stop:
+        moved = [x - shift for x in tail[:gap - stop]]
+        if moved and min(moved) < 0:
+            typecode = 'q'
+    result = array(typecode, old[:first])
+    if shift and gap < first:
+        result[gap:] = array(typecode, [x + shift for x in result[gap:]])
+    if middle.typecode != typecode:
+        middle = array(typecode, middle)
+    result.extend(middle)
+    if tail.typecode != typecode:
+        tail = array(typecode, tail)
+    if moved:
+        tail[:gap - stop] = array(typecode, moved)
+    result.extend(tail)
+    return result
+
+
+class TokenBatch(object):
+    # struct-of-arrays tokens of one buffer: kind ids (index into
+    # `tokens`), start and end offsets and, if asked for, start line
+    # numbers. indexing builds the token object. Tokenizer.edit leaves
+    # the offsets of the tokens from `gap` on `shift` short and their
+    # line numbers `line_shift` short, an edit only adds them to the
+    # tokens between it and the previous one. reading starts, ends or
+    # linenos adds them to the rest
+    __slots__ = ['tokens', 'data', 'kinds', 'raw_starts', 'raw_ends',
+                 'raw_linenos', 'encoding', 'lines', 'gap', 'shift',
+                 'line_shift']
+
+    def __init__(self, tokens, data, kinds, starts, ends, linenos=None,
+                 encoding=None):
+        self.tokens = tokens
+        self.data = data
+        self.kinds = kinds
+        self.raw_starts = starts
+        self.raw_ends = ends
+        self.raw_linenos = linenos
+        self.encoding = encoding
+        self.lines = LineIndex(data)
+        self.gap = len(kinds)
+        self.shift = 0
+        self.line_shift = 0
+
+    def settle(self):
+        gap = self.gap
+        for values, shift in ((self.raw_starts, self.shift),
+                              (self.raw_ends, self.shift),
+                              (self.raw_linenos, self.line_shift)):
+            if shift and values is not None:
+                values[gap:] = array(values.typecode,
+                                     [x + shift for x in values[gap:]])
+        self.gap = len(self.kinds)
+        self.shift = self.line_shift = 0
+
+    @property
+    def starts(self):
+        self.settle()
+        return self.raw_starts
+
+    @property
+    def ends(self):
+        self.settle()
+        return self.raw_ends
+
+    @property
+    def linenos(self):
+        self.settle()
+        return self.raw_linenos
+
+    @linenos.setter
+    def linenos(self, linenos):
+        self.settle()
+        self.raw_linenos = linenos
+
+    def span(self, i):
+        # (start, end) of token i
+        if i < 0:
+            i += len(self.kinds)
+        if i >= self.gap:
+            return (self.raw_starts[i] + self.shift,
+                    self.raw_ends[i] + self.shift)
+        return self.raw_starts[i], self.raw_ends[i]
+
+    def lineno(self, i):
+        if i < 0:
+            i += len(self.kinds)
+        if i >= self.gap:
+            return self.raw_linenos[i] + self.line_shift
+        return self.raw_linenos[i]
+
+    def find_end(self, offset):
+        # the first token ending past offset
+        gap = self.gap
+        i = bisect_right(self.raw_ends, offset, 0, gap)
+        if i < gap:
+            return i
+        return bisect_right(self.raw_ends, offset - self.shift, gap,
+                            len(self.kinds))
+
+    def find_start(self, offset):
+        # the token starting at offset, None if there's none
+        gap = self.gap
+        i = bisect_left(self.raw_starts, offset, 0, gap)
+        if i == gap:
+            i = bisect_left(self.raw_starts, offset - self.shift, gap,
+                            len(self.kinds))
+        if i < len(self.kinds) and self.span(i)[0] == offset:
+            return i
+        return None
+
+    def position(self, i):
+        return self.lines.position(self.span(i)[0])
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def text(self, i):
+        start, end = self.span(i)
+        return self.cut(start, end)
+
+    def cut(self, start, end):
+        text = self.data[start:end]
+        if not isinstance(text, (str, bytes)):
+            text = bytes(text)
+        if self.encoding is not None:
+            text = text.decode(self.encoding)
+        return text
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[x] for x in range(*i.indices(len(self)))]
+        start, end = self.span(i)
+        token = self.tokens[self.kinds[i]](self.cut(start, end))
+        token.raw_start = start
+        token.raw_end = end
+        token.raw_lines = lines = self.lines
+        if lines.edits:
+            token.placed = len(lines.edits)
+        return token
+
+    def __iter__(self):
+        for i in range(len(self.kinds)):
+            yield self[i]
+
+
+class TokenStream(object):
+    # push side of Tokenizer.stream: feed() returns the tokens finished
+    # by a chunk, the text of the token running into its end is kept in
+    # `pending` and scanned again with the next chunk only if the token
+    # has to be backtracked
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.reset()
+
+    def reset(self):
+        self.resume = ScanState()
+        self.pending = ''
+        # offset and position of the pending text in the whole input
+        self.offset = 0
+        self.lineno = 1
+        self.index = 0
+
+    def make_tokens(self, data, lines, kinds, starts, ends):
+        token_classes = self.tokenizer.dfa.tokens
+        offset = self.offset
+        tokens = []
+        for kind, start, end in zip(kinds, starts, ends):
+            token = token_classes[kind](data[start:end])
+            token.place(offset + start, offset + end, lines)
+            tokens.append(token)
+        return tokens
+
+    def feed(self, chunk):
+        resume = self.resume
+        data = self.pending + chunk
+        lines = LineIndex(data, self.offset, self.lineno, self.index)
+        kinds = []
+        starts = []
+        ends = []
+        try:
+            self.tokenizer.scan_into(data, len(self.pending), len(data),
+                                     resume, kinds, starts, ends)
+        except self.tokenizer.token_base.UnexpectedCharError as e:
+            e.lines = lines
+            e.offset += self.offset
+            raise
+        tokens = self.make_tokens(data, lines, kinds, starts, ends)
+        cut = resume.start
+        resume.rebase(cut)
+        self.pending = data[cut:]
+        newlines = data.count('\n', 0, cut)
+        if newlines:
+            self.lineno += newlines
+            self.index = cut - data.rfind('\n', 0, cut) - 1
         else:
-            raise self.token_base.UnexpectedEOFError()
+            self.index += cut
+        self.offset += cut
+        return tokens
+
+    def close(self):
+        data = self.pending
+        lines = LineIndex(data, self.offset, self.lineno, self.index)
+        kinds = []
+        starts = []
+        ends = []
+        try:
+            self.tokenizer.finish(data, self.resume, len(data),
+                                  kinds, starts, ends)
+        except self.tokenizer.token_base.UnexpectedCharError as e:
+            e.lines = lines
+            e.offset += self.offset
+            raise
+        tokens = self.make_tokens(data, lines, kinds, starts, ends)
+        self.reset()
+        return tokens
+
+
+class LazyData(object):
+    # `data` of a span token: the buffer is sliced, and the slice passed
+    # through the token class __init__, on first access only
+
+    def __init__(self, slot):
+        self.slot = slot
+
+    def __get__(self, token, owner=None):
+        if token is None:
+            return self
+        try:
+            return self.slot.__get__(token, owner)
+        except AttributeError:
+            token.__token_cls__.__init__(token, token.text())
+            return self.slot.__get__(token, owner)
+
+    def __set__(self, token, value):
+        self.slot.__set__(token, value)
+
+
+class SpanToken(object):
+    # mixed into the per token class subclass made by span_class
+    __slots__ = []
+
+    def __init__(self, buffer, start, end, encoding=None, lines=None):
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+        self.encoding = encoding
+        self.lines = lines
+
+    def text(self):
+        text = self.buffer[self.start:self.end]
+        if not isinstance(text, (str, bytes)):
+            text = bytes(text)
+        if self.encoding is not None:
+            text = text.decode(self.encoding)
+        return text
 
 
 class TokenBaseMixin(object):
+    __token_cls__ = None
+    regular_expr = None
+    # a keyword token has no regular_expr but `keywords`, texts of its
+    # `keyword_of` token it takes, compared lowercased with `ignore_case`
+    keywords = ()
+    keyword_of = None
+    ignore_case = False
+    # offsets into the tokenized input and its LineIndex, set by the
+    # Tokenizer. the offsets are kept as they were when `lines` had had
+    # `placed` edits, and moved by the ones after when read
+    raw_start = raw_end = raw_lines = None
+    placed = 0
 
     def __init__(self, data):
         self.data = data
 
+    def place(self, start, end, lines):
+        self.raw_start = start
+        self.raw_end = end
+        self.raw_lines = lines
+        if lines.edits:
+            self.placed = len(lines.edits)
+
+    def settle(self):
+        lines = self.raw_lines
+        if lines is None or self.placed == len(lines.edits):
+            return
+        for cut, shift in lines.edits[self.placed:]:
+            if self.raw_start >= cut:
+                self.raw_start += shift
+                self.raw_end += shift
+        self.placed = len(lines.edits)
+
+    @property
+    def start(self):
+        self.settle()
+        return self.raw_start
+
+    @start.setter
+    def start(self, start):
+        self.settle()
+        self.raw_start = start
+
+    @property
+    def end(self):
+        self.settle()
+        return self.raw_end
+
+    @end.setter
+    def end(self, end):
+        self.settle()
+        self.raw_end = end
+
+    @property
+    def lines(self):
+        return self.raw_lines
+
+    @lines.setter
+    def lines(self, lines):
+        self.settle()
+        self.raw_lines = lines
+        if lines is not None:
+            self.placed = len(lines.edits)
+
+    @property
+    def position(self):
+        # (lineno, index) of the token start
+        if self.lines is None:
+            return None
+        return self.lines.position(self.start)
+
+    @classmethod
+    def generate_nfa(cls):
+        # a new NFA of every token, in an arena of its own: nothing keeps
+        # it once the caller drops it
+        arena = []
+        root = NFAState(arena)
+        for token in cls.__tokens__.values():
+            if token.regular_expr is not None:
+                root.arc(None, TokenBuilder(token, arena).root)
+        return root
+
     @classmethod
-    def generate_dfa(cls):
-        states = cls.__token_states__
-        root = NFAState()
-        for state in states.values():
-            root.arc(None, state)
-        dfa = nfa2dfa(root)
+    def generate_dfa(cls, stats=None):
+        if stats is not None:
+            start = time.perf_counter()
+        nfa = cls.generate_nfa()
+        classes = CharClasses([nfa])
+        if stats is not None:
+            stats.lap('classes', start)
+        dfa = nfa2dfa(nfa, classes=classes, stats=stats)
         if dfa.is_final:
             raise Exception(
-                'invalid token, accept empty string: %s' % dfa.data.name)
+                'invalid token, accept empty string: %s' % dfa.data.__name__)
         return dfa
 
     @classmethod
-    def get_tokenizer(cls):
-        return Tokenizer(cls, cls.generate_dfa())
+    def char_classes(cls):
+        return CharClasses([cls.generate_nfa()]).partition()
+
+    @classmethod
+    def compile_dfa(cls, cache_dir=None, stats=None):
+        # with `cache_dir` the tables are loaded from (or saved to) a
+        # file keyed by the token definitions, see `cache`. `stats`, a
+        # BuildStats, is filled in and reported
+        if cache_dir is not None:
+            dfa = cache.load_dfa(cls, cache_dir)
+            if dfa is None:
+                dfa = cls.compile_dfa(stats=stats)
+                cache.save_dfa(cls, dfa, cache_dir)
+            elif stats is not None:
+                stats.cached = True
+                stats.report()
+            return dfa
+        if stats is None:
+            dfa = cls.generate_dfa()
+            return compile_dfa(dfa, dfa.classes,
+                               list(cls.__tokens__.values()))
+        dfa = cls.generate_dfa(stats)
+        start = time.perf_counter()
+        dfa = compile_dfa(dfa, dfa.classes, list(cls.__tokens__.values()))
+        stats.lap('tables', start)
+        stats.report()
+        return dfa
+
+    @classmethod
+    def lazy_dfa(cls, max_states=10000):
+        # the table builds its states from the NFA, which it keeps
+        nfa = cls.generate_nfa()
+        return LazyDFATable(nfa, CharClasses([nfa]),
+                            cls.__tokens__.values(), max_states)
+
+    @classmethod
+    def get_tokenizer(cls, cache_dir=None, lazy=False, backend='dfa',
+                      max_states=10000):
+        # backend 're' scans str data with the re module, see retokenize.
+        # `max_states` bounds the states a lazy DFA caches
+        if lazy:
+            dfa = cls.lazy_dfa(max_states)
+        else:
+            dfa = cls.compile_dfa(cache_dir)
+        if backend == 're':
+            from .retokenize import ReTokenizer
+            return ReTokenizer(cls, dfa)
+        return Tokenizer(cls, dfa)
+
+    @classmethod
+    def tokenize_many(cls, docs, workers=None, chunk_size=64, ordered=True,
+                      encoding=None, cache_dir=None):
+        return cls.get_tokenizer(cache_dir).tokenize_many(
+            docs, workers, chunk_size, ordered, encoding)
+
+    @classmethod
+    def span_class(cls):
+        span_cls = cls.__dict__.get('__span_class__', None)
+        if span_cls is None:
+            slot = [klass.__dict__['data'] for klass in cls.__mro__
+                    if 'data' in klass.__dict__][0]
+            span_cls = type(cls)(cls.__name__, (SpanToken, cls), {
+                '__token_base__': True,
+                '__module__': cls.__module__,
+                '__slots__': ['buffer', 'start', 'end', 'encoding',
+                              'lines'],
+                'data': LazyData(slot)})
+            cls.__span_class__ = span_cls
+        return span_cls
 
     def __repr__(self):
         return '%s(%r)' % (self.__class__.__name__, self.data)
 
     def __eq__(self, other):
-        return other.__class__ == self.__class__ and other.data == self.data
+        return (getattr(other, '__token_cls__', None) is self.__token_cls__
+                and other.data == self.data)
 
 
 def new_token_base():
@@ -211,25 +1331,52 @@ def new_token_base():
                 return type.__new__(meta, name, bases, attrs)
 
             reg_expr = attrs.get('regular_expr', None)
-            if reg_expr is None:
+            keywords = attrs.get('keywords', None)
+            if reg_expr is None and not keywords:
                 raise TypeError('missing regular_expr')
+            if reg_expr is not None and keywords:
+                raise TypeError('keywords take no regular_expr')
             if 'ignore' not in attrs:
                 attrs['ignore'] = False
 
             cls = type.__new__(meta, name, bases, attrs)
-            states = cls.__token_states__
-            if name in states:
+            if name in cls.__tokens__:
                 raise TypeError('Token %s duplicated' % name)
-            states[name] = TokenBuilder(cls).root
+            if keywords:
+                # texts of `keyword_of` tokens in `keywords` are taken as
+                # this token, see keyword_tables
+                of = attrs.get('keyword_of', None)
+                if (of is None or cls.__tokens__.get(of.__name__) is not of
+                        or of.keywords):
+                    raise TypeError('keyword_of of %s is not a token' % name)
+                if cls.ignore:
+                    # the keyword lookup comes after the skip of ignored
+                    # tokens, see Tokenizer.keyword
+                    raise TypeError('keyword token %s ignored' % name)
+                cls.keywords = tuple(keywords)
+            else:
+                # checks the pattern, the NFA is built again by each
+                # generate_nfa
+                TokenBuilder(cls)
+            cls.__tokens__[name] = cls
+            cls.__token_cls__ = cls
             return cls
 
     class UnexpectedCharError(Exception):
 
-        def __init__(self, lineno, index, char):
-            self.lineno = lineno
-            self.index = index
+        def __init__(self, lines, offset, char):
+            self.lines = lines
+            self.offset = offset
             self.char = char
 
+        @property
+        def lineno(self):
+            return self.lines.position(self.offset)[0]
+
+        @property
+        def index(self):
+            return self.lines.position(self.offset)[1]
+
         def __str__(self):
             return 'unexpected char at line %d:%d %r' % (
                 self.lineno, self.index, self.char)
@@ -238,7 +1385,7 @@ def new_token_base():
         pass
 
     return TokenMeta('TokenBase', (TokenBaseMixin,),
-                     {'__token_states__': {},
+                     {'__tokens__': {},
                       '__token_base__': True,
                       'UnexpectedCharError': UnexpectedCharError,
                       'UnexpectedEOFError': UnexpectedEOFError,
@@ -0,0 +1,96 @@
+from array import array
+
+from .tokenize import LineIndex
+
+
+class CompactTree(object):
+    # a parse tree as parallel arrays with one entry per node, in
+    # preorder: symbol number (see SymbolTable), first child and next
+    # sibling (-1 for none), and the node's span of `data`. tokens are
+    # leaves whose text is data[start:end], nothing is copied out of the
+    # input. node 0 is the root
+    __slots__ = ['symbols', 'data', 'encoding', 'kinds', 'first_child',
+                 'next_sibling', 'starts', 'ends', 'lines']
+
+    def __init__(self, symbols, data, encoding=None):
+        offset = 'I' if len(data) < 1 << 32 else 'Q'
+        self.symbols = symbols
+        self.data = data
+        self.encoding = encoding
+        self.kinds = array('H')
+        self.first_child = array('i')
+        self.next_sibling = array('i')
+        self.starts = array(offset)
+        self.ends = array(offset)
+        self.lines = LineIndex(data)
+
+    def add(self, symbol, start, end, parent=-1, last=-1):
+        # a node appended as a child of `parent` after its child `last`
+        # (-1 if it's the first), returns its index
+        node = len(self.kinds)
+        self.kinds.append(symbol)
+        self.first_child.append(-1)
+        self.next_sibling.append(-1)
+        self.starts.append(start)
+        self.ends.append(end)
+        if last >= 0:
+            self.next_sibling[last] = node
+        elif parent >= 0:
+            self.first_child[parent] = node
+        return node
+
+    def __len__(self):
+        return len(self.kinds)
+
+    @property
+    def nbytes(self):
+        return sum(len(x) * x.itemsize for x in (
+            self.kinds, self.first_child, self.next_sibling, self.starts,
+            self.ends))
+
+    def symbol(self, node):
+        return self.symbols[self.kinds[node]]
+
+    def is_token(self, node):
+        return self.symbols.is_token(self.kinds[node])
+
+    def children(self, node):
+        children = []
+        child = self.first_child[node]
+        while child >= 0:
+            children.append(child)
+            child = self.next_sibling[child]
+        return children
+
+    def text(self, node):
+        text = self.data[self.starts[node]:self.ends[node]]
+        if not isinstance(text, (str, bytes)):
+            text = bytes(text)
+        if self.encoding is not None:
+            text = text.decode(self.encoding)
+        return text
+
+    def position(self, node):
+        return self.lines.position(self.starts[node])
+
+    def to_rules(self, node=0):
+        # the subtree as GrammarRule nodes and tokens, what
+        # ASTBuilder.build gives
+        root = self.make(node)
+        pending = [(node, root)]
+        while pending:
+            node, obj = pending.pop()
+            for child in self.children(node):
+                child_obj = self.make(child)
+                obj.children.append(child_obj)
+                if not self.is_token(child):
+                    pending.append((child, child_obj))
+        return root
+
+    def make(self, node):
+        cls = self.symbol(node).cls
+        if not self.is_token(node):
+            return cls()
+        token = cls(self.text(node))
+        token.place(self.starts[node], self.ends[node], self.lines)
+        return token
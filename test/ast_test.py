@@ -0,0 +1,235 @@
+import io
+
+from pyparser.tokenize import new_token_base
+from pyparser.ast import (ASTBuilder, GrammarError, ParseError,
+                          PackratParser, MemoTable, ENTER, TOKEN, EXIT)
+
+
+TokenBase = new_token_base()
+
+
+class Num(TokenBase):
+    regular_expr = '[0-9]+'
+
+
+class Name(TokenBase):
+    regular_expr = '[a-z]+'
+
+
+class Op(TokenBase):
+    regular_expr = '[+\\-*/=(),;]'
+
+
+class Blank(TokenBase):
+    regular_expr = '[ \n]+'
+    ignore = True
+
+
+GRAMMAR = '''
+Stmts = (Stmt ';')* ;
+Stmt = ('let' Name '=' Expr | Expr) ;
+Expr = Term (('+' | '-') Term)* ;
+Term = (Num | Name | '(' Expr ')') ;
+'''
+
+
+def test_build():
+    ast = ASTBuilder(TokenBase, GRAMMAR)
+    rules = ast.rules
+    tree = ast.build('let x = (1 + y); x;')
+    Stmts, Stmt, Expr, Term = (rules['Stmts'], rules['Stmt'],
+                               rules['Expr'], rules['Term'])
+    assert tree == Stmts([
+        Stmt([Name('let'), Name('x'), Op('='), Expr([Term([
+            Op('('), Expr([Term([Num('1')]), Op('+'), Term([Name('y')])]),
+            Op(')')])])]),
+        Op(';'),
+        Stmt([Expr([Term([Name('x')])])]),
+        Op(';')])
+    assert ast.build('') == Stmts()
+
+
+def test_deep_nesting():
+    ast = ASTBuilder(TokenBase, GRAMMAR)
+    depth = 20000
+    tree = ast.build('(' * depth + '1' + ')' * depth + ';')
+    expr = tree.children[0].children[0]
+    for _ in range(depth):
+        expr = expr.children[0].children[1]
+    assert expr.children[0].children == [Num('1')]
+
+
+def test_errors():
+    ast = ASTBuilder(TokenBase, GRAMMAR)
+    for src, message in (('x;\n(1 + ;', 'line 2:5'),
+                         ('x', 'unexpected end'),
+                         ('let 1', "expected Name")):
+        try:
+            ast.build(src)
+        except ParseError as e:
+            assert message in str(e)
+        else:
+            assert False
+    for grammar in ('A = (B | Name) ; B = Name ;',
+                    'A = (A Num | Num) ;'):
+        try:
+            ASTBuilder(TokenBase, grammar).build('x')
+        except GrammarError:
+            pass
+        else:
+            assert False
+
+
+# not LL(1): Stmt's options both start with a Name, Args' loop with
+# what follows it
+PEG_GRAMMAR = '''
+Stmts = (Stmt ';')* ;
+Stmt = (Name '=' Expr | Expr) ;
+Expr = (Term '+' Expr | Term '-' Expr | Term) ;
+Term = (Num | Name '(' Args ')' | Name | '(' Expr ')') ;
+Args = (Expr ',')* Expr ;
+'''
+
+
+def test_packrat():
+    ast = ASTBuilder(TokenBase, PEG_GRAMMAR, packrat=True)
+    rules = ast.rules
+    Stmts, Stmt, Expr, Term, Args = (rules['Stmts'], rules['Stmt'],
+                                     rules['Expr'], rules['Term'],
+                                     rules['Args'])
+    tree = ast.build('x = 1 - y; f(x, 2);')
+    assert tree == Stmts([
+        Stmt([Name('x'), Op('='), Expr([
+            Term([Num('1')]), Op('-'), Expr([Term([Name('y')])])])]),
+        Op(';'),
+        Stmt([Expr([Term([Name('f'), Op('('), Args([
+            Expr([Term([Name('x')])]), Op(','),
+            Expr([Term([Num('2')])])]), Op(')')])])]),
+        Op(';')])
+    try:
+        ast.build('x = 1 +;')
+    except ParseError as e:
+        assert "unexpected Op(';') at line 1:7" in str(e)
+    else:
+        assert False
+
+
+def test_packrat_window():
+    ast = ASTBuilder(TokenBase, PEG_GRAMMAR, packrat=True, memo_window=8)
+    src = 'x = f(1, y + 2);' * 500
+    parser = ast.get_tables()
+    memo = MemoTable(len(parser.rules), 8)
+    tree = parser.parse(ast.tokenizer.tokens(src), memo)
+    assert len(memo) <= 9
+    assert tree == PackratParser(ast.rules).parse(ast.tokenizer.tokens(src))
+    assert len(tree.children) == 1000
+
+
+def test_edit():
+    ast = ASTBuilder(TokenBase, GRAMMAR)
+    src = 'let x = (1 + y); x;\n' * 50
+    tree, batch = ast.build_batch(src)
+    assert tree == ast.build(src)
+    offset = src.index('y', 500)
+    stmts = tree.children[::2]
+    tree, batch = ast.edit(tree, batch, offset, 1, '(y - 2)')
+    assert batch.data == src[:offset] + '(y - 2)' + src[offset + 1:]
+    assert tree == ast.build(batch.data)
+    # the statements but the edited one are the old nodes
+    changed = [k for k, (a, b) in enumerate(zip(tree.children[::2], stmts))
+               if a is not b]
+    assert changed == [offset // 20 * 2]
+    # and their tokens moved with the text
+    token = stmts[-1].children[0].children[0].children[0]
+    assert (token.start, token.position) == (batch[-2].start, (50, 17))
+    # edits of the edited tree, before and after each other
+    for line, column, deleted, inserted in [
+            (45, 0, 0, 'z;\n'), (1, 4, 1, 'w'), (46, 14, 0, ' + 1'),
+            (0, 0, 20, ''), (30, 0, 0, 'let v = 2;\n' * 30)]:
+        offset = len(''.join(batch.data.splitlines(True)[:line])) + column
+        tree, batch = ast.edit(tree, batch, offset, deleted, inserted)
+        assert tree == ast.build(batch.data)
+        assert (token.start, token.position) == (batch[-2].start,
+                                                 batch[-2].position)
+    offset = batch.data.index('y', 500)
+    try:
+        ast.edit(tree, batch, offset, 1, ';')
+    except ParseError:
+        pass
+    else:
+        assert False
+
+
+def test_compact_tree():
+    ast = ASTBuilder(TokenBase, GRAMMAR)
+    src = 'let x = (1 + y);\nx;'
+    tree = ast.build_compact(src)
+    assert tree.to_rules() == ast.build(src)
+    assert ast.build_compact('').to_rules() == ast.build('')
+    assert tree.symbol(0).name == 'Stmts'
+    stmt, semicolon = tree.children(0)[:2]
+    assert (tree.symbol(stmt).cls, tree.is_token(stmt)) == (
+        ast.rules['Stmt'], False)
+    assert tree.text(stmt) == 'let x = (1 + y)'
+    assert tree.symbol(semicolon).cls is Op and tree.is_token(semicolon)
+    last = tree.children(0)[2]
+    assert tree.position(last) == (2, 0)
+    # the tree is its arrays, with token text left in the input
+    assert tree.nbytes == len(tree) * 18
+    states = ast.get_tables().graph()
+    assert states[0].rule.name == 'Stmts' and states[0].final
+    assert [(arc[0].name, arc[1].num) for arc in states[0].arcs] == [
+        ('Stmt', 1)]
+
+
+def test_events():
+    ast = ASTBuilder(TokenBase, GRAMMAR)
+    Stmts, Stmt, Expr, Term = (ast.rules['Stmts'], ast.rules['Stmt'],
+                               ast.rules['Expr'], ast.rules['Term'])
+    assert list(ast.events('x;')) == [
+        (ENTER, Stmts), (ENTER, Stmt), (ENTER, Expr), (ENTER, Term),
+        (TOKEN, Name('x')), (EXIT, Term), (EXIT, Expr), (EXIT, Stmt),
+        (TOKEN, Op(';')), (EXIT, Stmts)]
+    # read a chunk at a time, one statement per line
+    src = 'let x = (1 + y);\n' * 1000
+    source = io.BytesIO(src.encode('utf-8'))
+    found = []
+
+    def stmt(event, value):
+        if event == TOKEN:
+            found.append(value.position)
+
+    def term(event, value):
+        if event == TOKEN and isinstance(value, Name):
+            found.append(value.data)
+
+    ast.walk(source, {Stmt: stmt, 'Term': term}, chunk_size=100)
+    assert len(found) == 4000
+    assert found[:4] == [(1, 0), (1, 4), (1, 6), 'y']
+    assert found[-4:] == [(1000, 0), (1000, 4), (1000, 6), 'y']
+    try:
+        list(ast.events('x; ('))
+    except ParseError as e:
+        assert 'unexpected end' in str(e)
+    else:
+        assert False
+
+
+def test_parse_many():
+    ast = ASTBuilder(TokenBase, GRAMMAR)
+    depth = 2000
+    docs = ['let x = (1 + y); x;', 'x; (', '', 'a @',
+            '(' * depth + '1' + ')' * depth + ';'] * 2
+    results = list(ast.parse_many(docs, 2, 3))
+    assert [i for i, _ in results] == list(range(len(docs)))
+    for i in (0, 2, 5, 7):
+        tree = ast.build(docs[i])
+        assert results[i][1] == tree and results[i][1].size == tree.size
+    assert results[0][1].__class__ is ast.rules['Stmts']
+    assert results[0][1].children[0].children[1].position == (1, 4)
+    assert isinstance(results[1][1], ParseError)
+    assert isinstance(results[3][1], TokenBase.UnexpectedCharError)
+    expr = results[4][1].children[0].children[0]
+    for _ in range(depth):
+        expr = expr.children[0].children[1]
+    assert expr.children[0].children == [Num('1')]
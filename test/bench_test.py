@@ -0,0 +1,36 @@
+import json
+import os
+import tempfile
+
+from pyparser import bench
+
+
+def test_run_and_compare():
+    report = bench.run(1, 20000, (5,), (1, 20))
+    results = report['results']
+    assert 'build/patterns-5/nfa2dfa' in results
+    assert 'build/class-ranges-20/simplify_dfa' in results
+    assert results['scan/batch']['tokens_per_s'] > 0
+    assert results['parse/events']['mb_per_s'] > 0
+    assert all(not row[-1] for row in bench.compare(report, report))
+
+    slower = json.loads(json.dumps(report))
+    slower['results']['parse/build']['seconds'] += 1
+    rows = dict((row[0], row[-1]) for row in bench.compare(report, slower))
+    assert rows['parse/build'] and not rows['scan/batch']
+
+    directory = tempfile.mkdtemp()
+    old = os.path.join(directory, 'old.json')
+    new = os.path.join(directory, 'new.json')
+    for path, data in ((old, report), (new, slower)):
+        with open(path, 'w') as f:
+            json.dump(data, f)
+    assert bench.main(['compare', old, old]) == 0
+    assert bench.main(['compare', old, new]) == 1
+
+    # --quick leaves --repeat and --size alone
+    out = os.path.join(directory, 'quick.json')
+    assert bench.main(['run', '--quick', '--size', '20000', '-o', out]) == 0
+    with open(out) as f:
+        meta = json.load(f)['meta']
+    assert (meta['repeat'], meta['size']) == (1, 20000)
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+
+from pyparser import cache
+from pyparser.tokenize import new_token_base
+from pyparser.ast import ASTBuilder
+
+
+def make_token_base(num_expr='[0-9]+'):
+    TokenBase = new_token_base()
+
+    class Num(TokenBase):
+        regular_expr = num_expr
+
+    class Name(TokenBase):
+        regular_expr = '[a-zA-Z_][a-zA-Z_0-9]*'
+
+    class Op(TokenBase):
+        regular_expr = '[+\\-*/=]'
+
+    class Blank(TokenBase):
+        regular_expr = '[ \t\r\n]+'
+        ignore = True
+
+    return TokenBase
+
+
+def test_token_cache():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        TokenBase = make_token_base()
+        built = TokenBase.compile_dfa(cache_dir)
+        path = cache.cache_path(
+            cache_dir, 'tokens', cache.token_base_key(TokenBase))
+        assert os.listdir(cache_dir) == [os.path.basename(path)]
+
+        loaded = TokenBase.compile_dfa(cache_dir)
+        assert isinstance(loaded.trans, memoryview)
+        assert list(loaded.trans) == list(built.trans)
+        assert list(loaded.accept) == list(built.accept)
+        assert loaded.tokens == built.tokens
+
+        tokenize = TokenBase.get_tokenizer(cache_dir)
+        src = 'a1 = b + 42'
+        expect = list(TokenBase.get_tokenizer().tokens(src))
+        assert list(tokenize.tokens(src)) == expect
+        assert loaded.__getstate__()['trans'] == built.trans
+
+        # another regular_expr is another key
+        TokenBase.compile_dfa(cache_dir)
+        make_token_base('[0-9]+([.][0-9]+)?').compile_dfa(cache_dir)
+        assert len(os.listdir(cache_dir)) == 2
+
+        with open(path, 'wb') as f:
+            f.write(b'garbage')
+        assert cache.load_dfa(TokenBase, cache_dir) is None
+        assert list(TokenBase.get_tokenizer(cache_dir).tokens(src)) == expect
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_grammar_cache():
+    grammar = '''
+    Expr = Term (Op Term)* ;
+    Term = (Num | Name | '(' Expr ')') ;
+    '''
+    cache_dir = tempfile.mkdtemp()
+    try:
+        TokenBase = make_token_base()
+        built = ASTBuilder(TokenBase, grammar, cache_dir).rules
+        loaded = ASTBuilder(TokenBase, grammar, cache_dir).rules
+        assert sorted(loaded) == sorted(built) == ['Expr', 'Term']
+        for name in built:
+            assert loaded[name] is not built[name]
+            expect = cache.dump_rule_dfa(built[name].root, object)
+            got = cache.dump_rule_dfa(loaded[name].root, object)
+            assert got == expect
+    finally:
+        shutil.rmtree(cache_dir)
@@ -0,0 +1,32 @@
+from pyparser.charset import CharSet, NegLabel, MAX_CHAR
+
+
+def test_build():
+    assert CharSet('cab').bounds == (97, 100)
+    charset = CharSet('ab', [('c', 'e'), ('x', 'z')])
+    assert charset.bounds == (97, 102, 120, 123)
+    assert CharSet(ranges=[('a', 'f'), ('c', 'd')]) == CharSet('abcdef')
+    assert list(CharSet('ba', [('x', 'y')])) == ['a', 'b', 'x', 'y']
+    assert len(CharSet(ranges=[(u'一', u'鿿')])) == 0x5200
+    assert not CharSet()
+    assert 'b' in CharSet('abc') and 'd' not in CharSet('abc')
+
+
+def test_ops():
+    az = CharSet(ranges=[('a', 'z')])
+    hex_ = CharSet(ranges=[('0', '9'), ('a', 'f')])
+    assert az | hex_ == CharSet(ranges=[('0', '9'), ('a', 'z')])
+    assert az & hex_ == CharSet('abcdef')
+    assert az - hex_ == CharSet(ranges=[('g', 'z')])
+    assert hex_ - az == CharSet(ranges=[('0', '9')])
+    assert ~az == CharSet(ranges=[(u'\x00', '`'), ('{', chr(MAX_CHAR - 1))])
+    assert ~~az == az
+    assert ~CharSet() == CharSet(ranges=[(u'\x00', chr(MAX_CHAR - 1))])
+
+
+def test_neg_label():
+    label = NegLabel(ranges=[(u'\x00', u'\x1f')])
+    assert label.bounds == (0x20, MAX_CHAR)
+    assert label != CharSet.from_bounds(label.bounds)
+    assert label == NegLabel(ranges=[(u'\x00', u'\x1f')])
+    assert u'一' in label and u'\n' not in label
@@ -0,0 +1,82 @@
+import importlib
+import os
+import sys
+import tempfile
+
+from pyparser.tokenize import new_token_base
+from pyparser.codegen import generate_source, compile_module, write_module
+
+
+def token_base():
+    TokenBase = new_token_base()
+
+    class Float(TokenBase):
+        regular_expr = '[0-9]+[.][0-9]+'
+
+    class Num(TokenBase):
+        regular_expr = '[0-9]+'
+
+    class Dot(TokenBase):
+        regular_expr = '[.]'
+
+    class String(TokenBase):
+        regular_expr = "'(\\\\['rnt]|[^'])*'"
+
+    class Name(TokenBase):
+        regular_expr = '[a-zA-Z_\u4e00-\u9fff][a-zA-Z_0-9]*'
+
+    class Blank(TokenBase):
+        regular_expr = '[ \t\n]+'
+        ignore = True
+
+    return TokenBase
+
+
+def test_generate():
+    TokenBase = token_base()
+    tokenize = TokenBase.get_tokenizer()
+    scanner = compile_module(TokenBase)
+    assert scanner.TOKENS == ('Float', 'Num', 'Dot', 'String', 'Name',
+                              'Blank')
+    src = u"abc 12.5 1.x '\\n\u4e2d' \u6587d_1 3.\n"
+    assert list(scanner.scan(src)) == list(tokenize.scan(src))
+    assert (list(scanner.tokens(src)) ==
+            [(t.__class__.__name__, t.data) for t in tokenize.tokens(src)])
+    for bad, offset, char in (("ab '\\a'", 5, 'a'), ("1 'x", 4, None)):
+        try:
+            list(scanner.scan(bad))
+        except scanner.TokenizeError as e:
+            assert (e.offset, e.char) == (offset, char)
+        else:
+            assert False
+
+
+def test_full_sets():
+    # transitions and loops taking every char
+    for expr, src in (('(a|[^a])', 'ab\u4e2d'),
+                      ("'(\\\\(\\\\|[^\\\\])|[^'\\\\])*'",
+                       "'a\\'b\\\\''\\x'"),
+                      ('#(\n|[^\n])*', '#a\n#\u4e2d')):
+        TokenBase = new_token_base()
+        type(TokenBase)('A', (TokenBase,), {'regular_expr': expr})
+        scanner = compile_module(TokenBase)
+        tokenize = TokenBase.get_tokenizer()
+        assert (list(scanner.tokens(src)) ==
+                [('A', t.data) for t in tokenize.tokens(src)])
+
+
+def test_write_module():
+    TokenBase = token_base()
+    source = generate_source(TokenBase)
+    assert 'import' not in source
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'scanner_mod.py')
+    write_module(TokenBase, path)
+    with open(path, 'rb') as f:
+        assert f.read().decode('utf-8') == source
+    sys.path.insert(0, directory)
+    try:
+        scanner = importlib.import_module('scanner_mod')
+    finally:
+        sys.path.remove(directory)
+    assert list(scanner.tokens('a 1.5')) == [('Name', 'a'), ('Float', '1.5')]
@@ -0,0 +1,63 @@
+from pyparser.tokenize import new_token_base
+from pyparser.retokenize import TranslateError
+
+
+def test_re_backend():
+    TokenBase = new_token_base()
+
+    class Float(TokenBase):
+        regular_expr = '[0-9]+[.][0-9]+'
+
+    class Num(TokenBase):
+        regular_expr = '[0-9]+'
+
+    class Dot(TokenBase):
+        regular_expr = '[.]'
+
+    class String(TokenBase):
+        regular_expr = "'[^']*'"
+
+    class Name(TokenBase):
+        regular_expr = '[a-zA-Z_][a-zA-Z_0-9]*'
+
+    class Op(TokenBase):
+        regular_expr = '(<(=)?|=|\\+)'
+
+    class Blank(TokenBase):
+        regular_expr = '[ \t\n]+'
+        ignore = True
+
+    dfa = TokenBase.get_tokenizer()
+    tokenize = TokenBase.get_tokenizer(backend='re')
+    src = "a<=1.5 'x\ny' 1.b 3.<<=c+2. _d\n" * 10
+    assert list(tokenize.scan(src)) == list(dfa.scan(src))
+    assert list(tokenize.tokens(src)) == list(dfa.tokens(src))
+    for bad, offset in (("1 'x", None), ('a $', 2)):
+        try:
+            list(tokenize.tokens(bad))
+        except TokenBase.UnexpectedCharError as e:
+            assert e.offset == offset
+        except TokenBase.UnexpectedEOFError:
+            assert offset is None
+        else:
+            assert False
+
+
+def test_untranslatable():
+    def problems(*exprs):
+        TokenBase = new_token_base()
+        for n, expr in enumerate(exprs):
+            type(TokenBase)('T%d' % n, (TokenBase,), {'regular_expr': expr})
+        try:
+            TokenBase.get_tokenizer(backend='re')
+        except TranslateError as e:
+            return sorted(set(name for name, _ in e.problems))
+        return []
+
+    assert problems('[a-z]+', '[0-9]+') == []
+    # positive arcs shadow `[^']` in the dialect, not in re
+    assert problems("'(\\\\['rnt]|[^'])*'") == ['T0']
+    assert problems('[a]+', '[^b]') == ['*']
+    # re would stop at the first alternative or keep repeating
+    assert problems('(<|<=)') == ['T0']
+    assert problems('x([a-z])*(bc)?') == ['T0']
@@ -1,5 +1,5 @@
 from pyparser.tokenize import new_token_base
-from pyparser.ast import ASTBuilder
+from pyparser.ast import ASTBuilder, GrammarError
 
 
 TokenBase = new_token_base()
@@ -30,7 +30,22 @@ class Blank(TokenBase):
 def test_tokens():
     data = open('test_grammar').read()
     ast = ASTBuilder(TokenBase, data)
-    ast.build('uid->getuser(uid) select * from table')
+    # Replace and Append both start with a Name
+    try:
+        ast.build('uid->getuser(uid) select * from table')
+    except GrammarError as e:
+        assert 'Prepare is ambiguous' in str(e)
+    else:
+        assert False
+
+
+def test_parse_many():
+    data = open('test_grammar').read()
+    ast = ASTBuilder(TokenBase, data)
+    docs = ['uid->getuser(uid) select * from table'] * 5
+    results = list(ast.parse_many(docs, 2, 2))
+    assert [i for i, _ in results] == list(range(5))
+    assert all(isinstance(error, GrammarError) for _, error in results)
 
 
 if __name__ == '__main__':
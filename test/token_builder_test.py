@@ -1,4 +1,7 @@
+import itertools
+
 from pyparser.tokenize import *
+from pyparser.charset import CharSet, NegLabel
 from pyparser.dfa import nfa2dfa
 
 
@@ -11,50 +14,59 @@ class FakeToken(object):
 
 def test_one_or_more():
     tok = TokenBuilder(FakeToken('abc', '[abc]+'))
-    assert len(tok.root.arcs) == 3
-    for c in 'abc':
-        assert len(tok.root.arcs[c]) == 1
-    tk = tok.root.arcs['a'][0]
+    assert len(tok.root.arcs) == 1
+    assert len(tok.root.arcs[CharSet('abc')]) == 1
+    tk = tok.root.arcs[CharSet('abc')][0]
     assert tk.is_final is True
-    for c in 'abc':
-        assert tok.root.arcs[c][0] is tk
+    assert tk.arcs[None][0] is tok.root
 
 
 def test_may_one():
     tok = TokenBuilder(FakeToken('abc', '[abc]?'))
-    assert len(tok.root.arcs) == 4
-    for c in ['a', 'b', 'c', None]:
+    assert len(tok.root.arcs) == 2
+    for c in [CharSet('abc'), None]:
         assert len(tok.root.arcs[c]) == 1
-    tk = tok.root.arcs['a'][0]
+    tk = tok.root.arcs[CharSet('abc')][0]
     assert tk.is_final is True
-    for c in ['a', 'b', 'c', None]:
-        assert tok.root.arcs[c][0] is tk
+    assert tok.root.arcs[None][0] is tk
 
 
 def test_any():
     tok = TokenBuilder(FakeToken('abc', '[abc]*'))
-    assert len(tok.root.arcs) == 4
-    for c in ['a', 'b', 'c', None]:
+    assert len(tok.root.arcs) == 2
+    for c in [CharSet('abc'), None]:
         assert len(tok.root.arcs[c]) == 1
-    tk = tok.root.arcs['a'][0]
+    tk = tok.root.arcs[CharSet('abc')][0]
     assert tk.is_final is True
-    for c in ['a', 'b', 'c', None]:
-        assert tok.root.arcs[c][0] is tk
+    assert tok.root.arcs[None][0] is tk
+    assert tk.arcs[None][0] is tok.root
+
+
+def test_ranges():
+    tok = TokenBuilder(FakeToken('abc', '[a-c_x-z][^\x00-\x1f\u4e00-\u9fff]'))
+    label, = tok.root.arcs.keys()
+    assert label == CharSet('_', [('a', 'c'), ('x', 'z')])
+    assert label.bounds == (95, 96, 97, 100, 120, 123)
+    neg_label, = tok.root.arcs[label][0].arcs.keys()
+    assert isinstance(neg_label, NegLabel)
+    assert ' ' in neg_label and '\x1f' not in neg_label
+    assert '\u4dff' in neg_label and '\u4e00' not in neg_label
+    assert neg_label.bounds == (0x20, 0x4e00, 0xa000, 0x110000)
 
 
 def test_simple():
     tok = TokenBuilder(FakeToken('abc', 'abc'))
     assert len(tok.root.arcs) == 1
-    assert len(tok.root.arcs['a']) == 1
-    node1 = tok.root.arcs['a'][0]
+    assert len(tok.root.arcs[CharSet('a')]) == 1
+    node1 = tok.root.arcs[CharSet('a')][0]
 
     assert len(node1.arcs) == 1
-    assert len(node1.arcs['b']) == 1
-    node2 = node1.arcs['b'][0]
+    assert len(node1.arcs[CharSet('b')]) == 1
+    node2 = node1.arcs[CharSet('b')][0]
 
     assert len(node2.arcs) == 1
-    assert len(node2.arcs['c']) == 1
-    node3 = node2.arcs['c'][0]
+    assert len(node2.arcs[CharSet('c')]) == 1
+    node3 = node2.arcs[CharSet('c')][0]
     assert len(node3.arcs) == 0
     assert node3.is_final is True
 
@@ -80,9 +92,38 @@ def test_dfa():
     tok = TokenBuilder(FakeToken('abc', '(ab)*ac'))
     s1 = nfa2dfa(tok.root)
     assert len(s1.arcs) == 1
-    s2 = s1.arcs['a']
+    s2 = s1.next('a')
     assert len(s2.arcs) == 2
-    assert s2.arcs['b'] is s1
-    s3 = s2.arcs['c']
+    assert s2.next('b') is s1
+    s3 = s2.next('c')
     assert len(s3.arcs) == 0
     assert s3.is_final is True
+
+
+def dfa_states(dfa):
+    states = [dfa]
+    for state in states:
+        for next_state in state.arcs.values():
+            if next_state not in states:
+                states.append(next_state)
+    return states
+
+
+def dfa_accept(dfa, s):
+    for c in s:
+        dfa = dfa.next(c)
+        if dfa is None:
+            return False
+    return dfa.is_final
+
+
+def test_minimize():
+    reg_expr = '(x(ab)*c|y(ab)*c)'
+    legacy = nfa2dfa(TokenBuilder(FakeToken('abc', reg_expr)).root,
+                     legacy_simplify=True)
+    dfa = nfa2dfa(TokenBuilder(FakeToken('abc', reg_expr)).root)
+    assert len(dfa_states(legacy)) == 6
+    assert len(dfa_states(dfa)) == 4
+    for n in range(7):
+        for s in itertools.product('abcxy', repeat=n):
+            assert dfa_accept(legacy, s) == dfa_accept(dfa, s)
@@ -1,4 +1,10 @@
+import io
+import mmap
+import pickle
+import tempfile
+
 from pyparser.tokenize import new_token_base
+from pyparser.charset import CharSet
 from pyparser.dfa import dfa_check
 
 
@@ -72,5 +78,650 @@ def test_tokens():
         assert token == expect
 
 
+def test_dfa_table():
+    from pyparser.ast import ast_tokenizer, Name, Eq, String, EndRule
+
+    dfa = pickle.loads(pickle.dumps(ast_tokenizer.dfa))
+    assert dfa.tokens == ast_tokenizer.dfa.tokens
+    assert len(dfa.trans) == dfa.nstates * dfa.nclasses
+    assert dfa.accept[0] == -1 and dfa.accept[1] == -1
+    state = dfa.next(dfa.next(1, 'a'), '1')
+    assert dfa.tokens[dfa.accept[state]] is Name
+    assert dfa.next(state, '-') == 0
+
+    tokenize = ast_tokenizer.__class__(ast_tokenizer.token_base, dfa)
+    tks = [Name('a'), Eq('='), String("'b'"), Name('c'), EndRule(';')]
+    assert list(tokenize.tokens("a = 'b' c; # end\n")) == tks
+
+    try:
+        list(tokenize.tokens('a = b;\n  c @'))
+    except ast_tokenizer.token_base.UnexpectedCharError as e:
+        assert (e.lineno, e.index, e.char) == (2, 4, '@')
+    else:
+        assert False
+    # the tokens before an error come out first, also from its window
+    # and from the end of the input
+    for src, error in (('a = b;\n  c @', 'UnexpectedCharError'),
+                       ("a = b;\n  c 'x", 'UnexpectedEOFError')):
+        found = []
+        try:
+            for token in tokenize.tokens(src):
+                found.append(token)
+        except Exception as e:
+            assert e.__class__.__name__ == error
+        else:
+            assert False
+        assert found == [Name('a'), Eq('='), Name('b'), EndRule(';'),
+                         Name('c')]
+
+
+def test_char_classes():
+    TokenBase = new_token_base()
+
+    class Num(TokenBase):
+        regular_expr = '[0-9]+'
+
+    class Name(TokenBase):
+        regular_expr = '[a-zA-Z_][a-zA-Z_0-9]*'
+
+    class String(TokenBase):
+        regular_expr = "'(\\\\['rnt]|[^'])*'"
+
+    classes = TokenBase.char_classes()
+    # digits, letters + `_`, `rnt`, quote, backslash, the rest of [^'],
+    # and class 0 which no label covers
+    assert classes.count == 7
+    assert classes.get('0') == classes.get('9')
+    assert classes.get('a') == classes.get('_') != classes.get('0')
+    assert classes.get('r') == classes.get('t') != classes.get('a')
+    assert classes.get('@') == classes.get('\u4e00') != 0
+    assert classes.charset(classes.get('r')) == CharSet('rnt')
+
+    dfa = TokenBase.generate_dfa()
+    tokenize = TokenBase.get_tokenizer()
+    for s in ["'asdf'", "'as\\'d'", "'\\nx'", "'\\ax'", 'a1', '12', "'x"]:
+        try:
+            tks = list(tokenize.tokens(s))
+        except (TokenBase.UnexpectedCharError, TokenBase.UnexpectedEOFError):
+            tks = []
+        expect = dfa_check(dfa, s)
+        assert tks == ([expect] if expect is not None else [])
+
+
+def test_unicode_ranges():
+    TokenBase = new_token_base()
+
+    class Han(TokenBase):
+        regular_expr = u'[\u4e00-\u9fff]+'
+
+    class Text(TokenBase):
+        regular_expr = u'[^\x00-\x1f\u4e00-\u9fff ]+'
+
+    class Blank(TokenBase):
+        regular_expr = '[ ]+'
+
+    tokenize = TokenBase.get_tokenizer()
+    assert tokenize.dfa.nclasses == 4
+    assert list(tokenize.tokens(u'abc \u4e2d\u6587 x\U0001f600')) == [
+        Text('abc'), Blank(' '), Han(u'\u4e2d\u6587'), Blank(' '),
+        Text(u'x\U0001f600')]
+
+
+def test_lazy_dfa():
+    TokenBase = new_token_base()
+
+    class Num(TokenBase):
+        regular_expr = '[0-9]+'
+
+    class String(TokenBase):
+        regular_expr = "'(\\\\['rnt]|[^'])*'"
+
+    class Name(TokenBase):
+        regular_expr = '[a-zA-Z_][a-zA-Z_0-9]*'
+
+    class Blank(TokenBase):
+        regular_expr = '[ \t\n]+'
+        ignore = True
+
+    src = "abc 12 'x\\ny' d_1 'q' 7\n"
+    expect = list(TokenBase.get_tokenizer().tokens(src))
+
+    tokenize = TokenBase.get_tokenizer(lazy=True)
+    assert tokenize.dfa.nstates == 2
+    assert list(tokenize.tokens('123')) == [Num('123')]
+    assert tokenize.dfa.nstates == 3
+    assert list(tokenize.tokens(src)) == expect
+
+    tokenize = TokenBase.get_tokenizer(lazy=True, max_states=4)
+    dfa = tokenize.dfa
+    assert list(tokenize.tokens(src)) == expect
+    assert dfa.flushes > 0 and dfa.nstates <= 4
+
+
+def test_lazy_dfa_backtracking():
+    import random
+
+    TokenBase = new_token_base()
+    for name, expr in [('A', 'a'), ('B', 'b'), ('AB', '(a|b)*c'),
+                       ('AX', '[a]+[b]+d'), ('BA', '(ab)+e')]:
+        type(name, (TokenBase,), {'regular_expr': expr})
+
+    def scan(tokenize, src, window):
+        try:
+            return list(tokenize.scan(src, window=window))
+        except TokenBase.UnexpectedCharError as e:
+            return e.offset
+        except TokenBase.UnexpectedEOFError:
+            return 'eof'
+
+    # flushes renumber the states the backtracking memo holds
+    tokenize = TokenBase.get_tokenizer()
+    rand = random.Random(0)
+    for max_states in (3, 4, 6):
+        for _ in range(300):
+            src = ''.join(rand.choice('abcde')
+                          for _ in range(rand.randint(1, 20)))
+            window = rand.choice((3, 16384))
+            lazy = tokenize.__class__(TokenBase,
+                                      TokenBase.lazy_dfa(max_states))
+            assert scan(lazy, src, window) == scan(tokenize, src, window)
+
+
+def test_back_to_start():
+    # the minimized DFAs of these come back to state 1 within a token,
+    # which isn't where one ends
+    for expr, good, bad in [
+            ('([0-9]+[.])*[0-9]+', ['1.2', '1.22.3'], ['1.2.', '1.']),
+            ('(([b-c]([^a][^a]c)*(c)?)*|[ab]((c[b-c]|a))?)*[^a]',
+             ['d', 'ad', 'aad'], ['a', 'dabadaa'])]:
+        TokenBase = new_token_base()
+        type(TokenBase)('A', (TokenBase,), {'regular_expr': expr})
+        for lazy in (False, True):
+            tokenize = TokenBase.get_tokenizer(lazy=lazy)
+            for src in good:
+                assert [t.data for t in tokenize.batch(src)] == [src]
+            for src in bad:
+                for scan in (tokenize.tokens, tokenize.batch):
+                    try:
+                        list(scan(src))
+                    except (TokenBase.UnexpectedCharError,
+                            TokenBase.UnexpectedEOFError):
+                        pass
+                    else:
+                        assert False
+
+
+def test_stream():
+    TokenBase = new_token_base()
+
+    class Num(TokenBase):
+        regular_expr = '[0-9]+'
+
+    class String(TokenBase):
+        regular_expr = "'(\\\\['rnt]|[^'])*'"
+
+    class Name(TokenBase):
+        regular_expr = '[a-zA-Z_][a-zA-Z_0-9]*'
+
+    class Blank(TokenBase):
+        regular_expr = '[ \t\n]+'
+        ignore = True
+
+    tokenize = TokenBase.get_tokenizer()
+    src = u"abc 12 '\u4e2d\\n\u6587'\n  d_1 'q'   7"
+    expect = list(tokenize.tokens(src))
+    data = src.encode('utf-8')
+    for size in range(1, 8):
+        assert list(tokenize.stream(io.StringIO(src), size)) == expect
+        assert list(tokenize.stream(io.BytesIO(data), size)) == expect
+        chunks = [data[i:i + size] for i in range(0, len(data), size)]
+        assert list(tokenize.stream(iter(chunks))) == expect
+        streamed = tokenize.stream(io.StringIO(src), size)
+        assert ([(t.start, t.end, t.position) for t in streamed] ==
+                [(t.start, t.end, t.position) for t in expect])
+
+    bad = src + u"\n 'x\\a'"
+    try:
+        list(tokenize.tokens(bad))
+    except TokenBase.UnexpectedCharError as e:
+        expect_error = (e.lineno, e.index, e.char)
+    for size in range(1, 8):
+        try:
+            list(tokenize.stream(io.StringIO(bad), size))
+        except TokenBase.UnexpectedCharError as e:
+            assert (e.lineno, e.index, e.char) == expect_error
+        else:
+            assert False
+        try:
+            list(tokenize.stream(io.StringIO(src + "'x"), size))
+        except TokenBase.UnexpectedEOFError:
+            pass
+        else:
+            assert False
+
+
+def test_longest_match():
+    TokenBase = new_token_base()
+
+    class Float(TokenBase):
+        regular_expr = '[0-9]+[.][0-9]+'
+
+    class Num(TokenBase):
+        regular_expr = '[0-9]+'
+
+    class Dot(TokenBase):
+        regular_expr = '[.]'
+
+    class Name(TokenBase):
+        regular_expr = '[a-z]+'
+
+    expect = [Num('1'), Dot('.'), Name('x'), Float('2.5'), Dot('.'),
+              Num('3'), Dot('.')]
+    src = '1.x2.5.3.'
+    for tokenize in (TokenBase.get_tokenizer(),
+                     TokenBase.get_tokenizer(lazy=True)):
+        assert list(tokenize.tokens(src)) == expect
+        assert list(tokenize.batch(src)) == expect
+        for size in range(1, 5):
+            assert list(tokenize.stream(io.StringIO(src), size)) == expect
+        try:
+            list(tokenize.tokens('1.x2.y'))
+        except TokenBase.UnexpectedCharError as e:
+            assert False
+
+
+def test_backtracking_is_linear():
+    TokenBase = new_token_base()
+
+    class A(TokenBase):
+        regular_expr = 'a'
+
+    class Run(TokenBase):
+        regular_expr = '[a]*b'
+
+    # without the memo each A would be scanned to the end again
+    tokenize = TokenBase.get_tokenizer()
+    src = 'a' * 100000
+    assert len(list(tokenize.scan(src))) == len(src)
+    assert len(list(tokenize.scan(src + 'b'))) == 1
+    kinds = [kind for kind, _, _ in tokenize.scan(src + 'bab' + src)]
+    assert len(kinds) == 2 + len(src)
+    try:
+        list(tokenize.scan(src + 'c'))
+    except TokenBase.UnexpectedCharError as e:
+        assert e.offset == len(src)
+    else:
+        assert False
+
+
+def test_long_pattern():
+    TokenBase = new_token_base()
+
+    class Long(TokenBase):
+        regular_expr = '(a|b)?' * 1000 + 'c'
+
+    # its epsilon chains are deeper than the recursion limit
+    tokenize = TokenBase.get_tokenizer()
+    src = 'ab' * 500 + 'c' + 'ac'
+    assert list(tokenize.scan(src)) == [(0, 0, 1001), (0, 1001, 1003)]
+
+
+def test_nfa_released():
+    import gc
+    from pyparser.dfa import NFAState
+
+    def nfa_count():
+        gc.collect()
+        return sum(1 for x in gc.get_objects() if isinstance(x, NFAState))
+
+    before = nfa_count()
+    TokenBase = new_token_base()
+
+    class Num(TokenBase):
+        regular_expr = '[0-9]+'
+
+    class Name(TokenBase):
+        regular_expr = '[a-z]+'
+
+    # every build numbers its states from 0
+    assert TokenBase.generate_nfa().id == 0
+    assert TokenBase.generate_nfa().arcs[None][1].id > 0
+    tokenize = TokenBase.get_tokenizer()
+    dfa = TokenBase.generate_dfa()
+    assert nfa_count() == before
+    assert dfa.next('a').next('b').data is Name
+    assert list(tokenize.tokens('ab12')) == [Name('ab'), Num('12')]
+
+
+def test_parallel_batch():
+    TokenBase = new_token_base()
+
+    class Float(TokenBase):
+        regular_expr = '[0-9]+[.][0-9]+'
+
+    class Num(TokenBase):
+        regular_expr = '[0-9]+'
+
+    class Dot(TokenBase):
+        regular_expr = '[.]'
+
+    class String(TokenBase):
+        regular_expr = "'(\\\\['rnt]|[^'])*'"
+
+    class Name(TokenBase):
+        regular_expr = '[a-zA-Z_][a-zA-Z_0-9]*'
+
+    class Blank(TokenBase):
+        regular_expr = '[ \t\n]+'
+        ignore = True
+
+    tokenize = TokenBase.get_tokenizer()
+    src = "abc 12.5 ' x y 1.2 ' 3. d_1 'q\\n'  \n 7.\n" * 40
+    expect = tokenize.batch(src)
+    for chunk_size in (7, 50, 301):
+        batch = tokenize.parallel_batch(src, 3, chunk_size)
+        assert list(batch.kinds) == list(expect.kinds)
+        assert list(batch.starts) == list(expect.starts)
+        assert list(batch.ends) == list(expect.ends)
+    data = src.encode('ascii')
+    batch = tokenize.parallel_batch(data, 2, 64, encoding='ascii')
+    assert list(batch) == list(expect)
+
+    try:
+        tokenize.parallel_batch(src + '$' + src, 3, 64)
+    except TokenBase.UnexpectedCharError as e:
+        assert (e.offset, e.char) == (len(src), '$')
+    else:
+        assert False
+
+
+def test_tokenize_many():
+    TokenBase = new_token_base()
+
+    class Num(TokenBase):
+        regular_expr = '[0-9]+'
+
+    class Name(TokenBase):
+        regular_expr = '[a-z]+'
+
+    class Blank(TokenBase):
+        regular_expr = '[ ]+'
+        ignore = True
+
+    docs = ['ab 12', '', 'x$', 'q 7 z'] * 20
+    for ordered in (True, False):
+        results = list(TokenBase.tokenize_many(docs, 2, 3, ordered))
+        if ordered:
+            assert [i for i, _ in results] == list(range(len(docs)))
+        results = [result for _, result in sorted(results)]
+        for doc, result in zip(docs, results):
+            if doc == 'x$':
+                assert isinstance(result, TokenBase.UnexpectedCharError)
+                assert (result.index, result.char) == (1, '$')
+            else:
+                tokenize = TokenBase.get_tokenizer()
+                assert list(result) == list(tokenize.tokens(doc))
+
+
+def test_positions():
+    TokenBase = new_token_base()
+
+    class Name(TokenBase):
+        regular_expr = '[a-z]+'
+
+    class Blank(TokenBase):
+        regular_expr = '[ \n]+'
+        ignore = True
+
+    tokenize = TokenBase.get_tokenizer()
+    src = 'ab cd\n\n  ef\ng'
+    expect = [(1, 0), (1, 3), (3, 2), (4, 0)]
+    tokens = list(tokenize.tokens(src))
+    assert [(t.start, t.end) for t in tokens] == [(0, 2), (3, 5), (9, 11),
+                                                 (12, 13)]
+    assert [t.position for t in tokens] == expect
+    data = src.encode('ascii')
+    for buf in (data, memoryview(data)):
+        assert [t.position for t in tokenize.span_tokens(buf)] == expect
+    batch = tokenize.batch(src)
+    assert [batch.position(i) for i in range(len(batch))] == expect
+    assert batch[2].position == (3, 2)
+    assert Name('ab').position is None
+
+    try:
+        list(tokenize.tokens(src + '\n  X'))
+    except TokenBase.UnexpectedCharError as e:
+        assert (e.offset, e.lineno, e.index, e.char) == (16, 5, 2, 'X')
+    else:
+        assert False
+
+
+def test_span_tokens():
+    from pyparser.ast import ast_tokenizer, Name, String
+
+    src = u"rule = Name '\u4e2d' ; # x\n  rule2 = '='"
+    expect = list(ast_tokenizer.tokens(src))
+    data = src.encode('utf-8')
+    with tempfile.TemporaryFile() as f:
+        f.write(data)
+        f.flush()
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        for data in [data, bytearray(data), memoryview(data), buf]:
+            tks = list(ast_tokenizer.span_tokens(data, 'utf-8'))
+            assert isinstance(tks[0], Name) and isinstance(tks[3], String)
+            assert (tks[3].start, tks[3].end) == (12, 17)
+            assert tks == expect
+        buf.close()
+
+    tks = list(ast_tokenizer.span_tokens(b"a = 'b'"))
+    slot = tks[2].__class__.__dict__['data'].slot
+    try:
+        slot.__get__(tks[2])
+    except AttributeError:
+        pass
+    else:
+        assert False
+    assert tks[2].data == b'b' and tks[0].data == b'a'
+    assert slot.__get__(tks[2]) == b'b'
+
+    try:
+        list(ast_tokenizer.span_tokens(memoryview(b'a\n  @')))
+    except ast_tokenizer.token_base.UnexpectedCharError as e:
+        assert (e.lineno, e.index, e.char) == (2, 2, '@')
+    else:
+        assert False
+
+
+def test_batch():
+    from pyparser.ast import ast_tokenizer, Name, String
+
+    src = u"rule = Name '\u4e2d' ;\n# x\n  rule2 = ('=')*;"
+    expect = list(ast_tokenizer.tokens(src))
+    batch = ast_tokenizer.batch(src, linenos=True)
+    assert len(batch) == len(expect)
+    assert batch.kinds.typecode == 'H' and batch.starts.typecode == 'I'
+    assert list(batch) == expect and batch[-3:] == expect[-3:]
+    assert ast_tokenizer.dfa.tokens[batch.kinds[3]] is String
+    assert (batch.starts[3], batch.ends[3]) == (12, 15)
+    assert list(batch.linenos) == [1, 1, 1, 1, 1, 3, 3, 3, 3, 3, 3]
+
+    batch = ast_tokenizer.batch(src.encode('utf-8'), encoding='utf-8')
+    assert list(batch) == expect
+    assert batch.text(3) == u"'\u4e2d'"
+
+
+def test_edit():
+    from pyparser.ast import ast_tokenizer
+
+    def check(tokenize, src, offset, deleted, inserted):
+        batch = tokenize.batch(src, linenos=True)
+        new = src[:offset] + inserted + src[offset + deleted:]
+        edited, (first, old_stop, new_stop) = tokenize.edit(
+            batch, offset, deleted, inserted)
+        expect = tokenize.batch(new, linenos=True)
+        assert edited.data == new
+        for name in ('kinds', 'starts', 'ends', 'linenos'):
+            assert list(getattr(edited, name)) == list(getattr(expect, name))
+        assert list(edited) == list(expect)
+        return first, old_stop, new_stop
+
+    src = "a = b c ; # x\nrule = ('x' | y)* ;\n" * 100
+    assert ast_tokenizer.dfa.lookahead() == 1
+    offset = src.index('y', 1000)
+    k = list(ast_tokenizer.batch(src).starts).index(offset)
+    # only `y` is scanned again
+    assert check(ast_tokenizer, src, offset, 1, 'yz') == (k, k + 1, k + 1)
+    assert check(ast_tokenizer, src, offset, 1, "'y'") == (k, k + 1, k + 1)
+    assert check(ast_tokenizer, src, offset, 0, '\n\n') == (k, k, k)
+    assert check(ast_tokenizer, src, 6, 0, '# ') == (3, 5, 3)
+    check(ast_tokenizer, src, len(src) - 1, 1, 'x')
+    check(ast_tokenizer, src, 0, len(src), '')
+
+    TokenBase = new_token_base()
+
+    class A(TokenBase):
+        regular_expr = 'a'
+
+    class Run(TokenBase):
+        regular_expr = '[a]*b'
+
+    # a b far on changes all the A before it
+    tokenize = TokenBase.get_tokenizer()
+    assert tokenize.dfa.lookahead() is None
+    assert check(tokenize, 'a' * 50, 50, 0, 'b') == (0, 50, 1)
+
+    # edits of an edited batch, back and forth: the tokens already made
+    # follow them
+    batch = ast_tokenizer.batch(src, linenos=True)
+    token = batch[-1]
+    for offset, deleted, inserted in [(1000, 3, 'x\n\n'), (10, 0, 'yy'),
+                                      (2000, 20, ''), (5, 2, '# z\n'),
+                                      (3000, 0, "'a'\n" * 40), (0, 4, '')]:
+        src = src[:offset] + inserted + src[offset + deleted:]
+        batch, _ = ast_tokenizer.edit(batch, offset, deleted, inserted)
+        expect = ast_tokenizer.batch(src, linenos=True)
+        assert batch[-1].position == expect[-1].position
+        assert (token.start, token.position) == (expect[-1].start,
+                                                 expect[-1].position)
+    for name in ('kinds', 'starts', 'ends', 'linenos'):
+        assert list(getattr(batch, name)) == list(getattr(expect, name))
+    assert list(batch) == list(expect)
+
+
+def test_stats():
+    from pyparser.stats import BuildStats
+
+    TokenBase = new_token_base()
+
+    class Float(TokenBase):
+        regular_expr = '[0-9]+[.][0-9]+'
+
+    class Num(TokenBase):
+        regular_expr = '[0-9]+'
+
+    class Dot(TokenBase):
+        regular_expr = '[.]'
+
+    class Name(TokenBase):
+        regular_expr = '[a-z\u4e00-\u9fff]+'
+
+    class Blank(TokenBase):
+        regular_expr = '[ ]+'
+        ignore = True
+
+    reported = []
+    stats = BuildStats(reported.append)
+    dfa = TokenBase.compile_dfa(stats=stats)
+    assert reported == [stats] and not stats.cached
+    assert stats.nfa_states > stats.dfa_states >= stats.min_states
+    assert stats.min_states == dfa.nstates - 1
+    assert stats.closure_misses > 0 and stats.subset_hits > 0
+    assert set(stats.times) == set(['classes', 'subset', 'minimize',
+                                    'tables'])
+
+    tokenize = TokenBase.get_tokenizer()
+    src = u'ab 12.5 1.x \u4e2d'
+    stats = tokenize.profile(src)
+    assert stats.chars == len(src) and stats.tokens == 6
+    assert stats.counts == {'Name': 3, 'Blank': 3, 'Float': 1, 'Num': 1,
+                            'Dot': 1}
+    assert stats.sizes['Float'] == 4 and stats.sizes['Blank'] == 3
+    # one token start per token, and a visit per char
+    assert stats.state_visits[1] == 9
+    assert sum(stats.state_visits) == 9 + len(src)
+    # `1.x` backs off to `1`, `\u4e2d` is bisected
+    assert stats.backtracks == 1 and stats.class_misses == 1
+    assert list(tokenize.scan(src)) == list(TokenBase.get_tokenizer().scan(
+        src))
+
+
+def test_keywords():
+    from pyparser.codegen import compile_module
+
+    TokenBase = new_token_base()
+
+    class Name(TokenBase):
+        regular_expr = '[a-zA-Z_][a-zA-Z_0-9]*(-[a-zA-Z_0-9]+)*'
+
+    class Keyword(TokenBase):
+        keyword_of = Name
+        keywords = ['select', 'from', 'where']
+        ignore_case = True
+
+    class Const(TokenBase):
+        keyword_of = Name
+        keywords = ['NULL', 'TRUE']
+
+    class Op(TokenBase):
+        regular_expr = '[,=\\-]'
+
+    class Blank(TokenBase):
+        regular_expr = '[ \n]+'
+        ignore = True
+
+    tokenize = TokenBase.get_tokenizer()
+    # keywords are looked up, not built into the DFA
+    dfa = tokenize.dfa
+    assert (set(dfa.tokens[kind] for kind in dfa.accept if kind >= 0) ==
+            set([Name, Op, Blank]))
+    # `FROM-` backs off to `FROM`, `where` ends the input
+    src = 'SELECT a-b, NULL, null FROM- t where'
+    expect = [Keyword('SELECT'), Name('a-b'), Op(','), Const('NULL'),
+              Op(','), Name('null'), Keyword('FROM'), Op('-'), Name('t'),
+              Keyword('where')]
+    assert list(tokenize.tokens(src)) == expect
+    assert list(tokenize.stream(io.StringIO(src), 3)) == expect
+    assert list(tokenize.batch(src.encode('ascii'))) == [
+        token.__class__(token.data.encode('ascii')) for token in expect]
+    scanned = list(tokenize.scan(src))
+    assert list(TokenBase.get_tokenizer(lazy=True).scan(src)) == scanned
+    assert list(TokenBase.get_tokenizer(backend='re').scan(src)) == scanned
+    assert list(compile_module(TokenBase).scan(src)) == scanned
+
+    for attrs in ({'keywords': ['x']},
+                  {'keywords': ['x'], 'keyword_of': Keyword},
+                  {'keywords': ['x'], 'keyword_of': Name,
+                   'regular_expr': 'x'},
+                  {'keywords': ['x'], 'keyword_of': Name, 'ignore': True}):
+        try:
+            type('Bad', (TokenBase,), attrs)
+        except TypeError:
+            pass
+        else:
+            assert False
+
+    class Again(TokenBase):
+        keyword_of = Name
+        keywords = ['Select']
+        ignore_case = True
+
+    try:
+        TokenBase.compile_dfa()
+    except Exception as e:
+        assert 'select' in str(e)
+    else:
+        assert False
+
+
 if __name__ == '__main__':
     test_tokens()